@@ -4,6 +4,7 @@ Provides MCP endpoints, sync capabilities and webhook support
 """
 
 import os
+import sys
 import json
 import hashlib
 import hmac
@@ -17,6 +18,7 @@ from pydantic import BaseModel, Field
 from loguru import logger
 
 from knowledge_copilot.rag_service import create_rag_service
+from knowledge_copilot.services import migrate_database
 from knowledge_copilot.connectors.github_sync import sync_github
 from knowledge_copilot.connectors.gdrive_sync import sync_drive
 
@@ -505,5 +507,10 @@ async def root():
     }
 
 if __name__ == "__main__":
+    # `python app.py migrate` applies schema migrations before a deploy
+    if sys.argv[1:2] == ["migrate"]:
+        migrate_database(DATABASE_URL or None)
+        sys.exit(0)
+    
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
@@ -76,6 +76,34 @@ build_image() {
     echo_info "Image built and pushed: ${IMAGE_NAME}"
 }
 
+# Apply database migrations with a one-off Cloud Run job
+run_migrations() {
+    echo_info "Running database migrations..."
+    
+    SQL_INSTANCE_CONN="${PROJECT_ID}:${REGION}:kc-postgres"
+    
+    # The service refuses to start on an unmigrated schema, so this must
+    # finish before the new revision is deployed
+    gcloud run jobs deploy ${SERVICE_NAME}-migrate \
+        --image ${IMAGE_NAME} \
+        --region ${REGION} \
+        --command python \
+        --args app.py,migrate \
+        --memory 1Gi \
+        --task-timeout 3600 \
+        --max-retries 0 \
+        --set-secrets="SQL_PASSWORD=SQL_PASSWORD:latest" \
+        --set-env-vars="PROJECT_ID=${PROJECT_ID}" \
+        --set-env-vars="SQL_INSTANCE=kc-postgres" \
+        --set-env-vars="SQL_DB=kcdb" \
+        --set-env-vars="SQL_USER=postgres" \
+        --set-cloudsql-instances ${SQL_INSTANCE_CONN} \
+        --execute-now \
+        --wait
+    
+    echo_info "Database migrated"
+}
+
 # Deploy to Cloud Run
 deploy_service() {
     echo_info "Deploying to Cloud Run..."
@@ -188,6 +216,7 @@ main() {
         build_image
     fi
     
+    run_migrations
     deploy_service
     set_permissions
     get_service_url
@@ -3,17 +3,20 @@ DocPilot Agent - RAG-powered conversational agent
 Jour 5: Agent + CLI/mini-UI & Qualité
 """
 
+import asyncio
+import importlib.util
 import os
 import time
 import uuid
 from typing import List, Dict, Any, Optional, Tuple
-from dataclasses import dataclass
+from dataclasses import astuple, dataclass
 import httpx
 import openai
 from google.cloud import aiplatform
 from loguru import logger
 
 from .observability import ObservabilityMixin
+from .utils.semantic_cache import SemanticQueryCache
 
 
 @dataclass
@@ -26,6 +29,8 @@ class AgentResponse:
     chunks_scanned: int
     confidence: Optional[float] = None
     fallback_used: bool = False
+    batch_used: bool = False  # query embedded in a shared ask_batch request
+    cache_hit: bool = False  # answer served from the semantic answer cache
 
 
 @dataclass
@@ -44,14 +49,22 @@ class MCPClient:
     def __init__(self, base_url: str, timeout: int = 30):
         self.base_url = base_url.rstrip('/')
         self.timeout = timeout
-        self.client = httpx.AsyncClient(timeout=timeout)
+        # HTTP/2 is negotiated over TLS (e.g. Cloud Run) when h2 is installed,
+        # plain http stays on HTTP/1.1; either way keep-alive connections are
+        # reused across questions
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+        )
     
     async def search_documents(
         self, 
         query: str, 
-        filters: SearchFilter
+        filters: SearchFilter,
+        query_embedding: Optional[List[float]] = None
     ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
-        """Search documents via MCP service"""
+        """Search documents via MCP service (by vector if the query embedding is known)"""
         search_payload = {
             "query": query,
             "limit": filters.top_k,
@@ -61,9 +74,15 @@ class MCPClient:
         if filters.source:
             search_payload["source_filter"] = filters.source
         
+        endpoint = "/search"
+        if query_embedding is not None:
+            # Skip server-side embedding of the query
+            search_payload["embedding"] = query_embedding
+            endpoint = "/search-by-vector"
+        
         try:
             response = await self.client.post(
-                f"{self.base_url}/search",
+                f"{self.base_url}{endpoint}",
                 json=search_payload
             )
             response.raise_for_status()
@@ -78,6 +97,19 @@ class MCPClient:
             logger.error(f"MCP HTTP error: {e.response.status_code} - {e.response.text}")
             raise
     
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts via MCP service, with the model used for indexing"""
+        try:
+            response = await self.client.post(
+                f"{self.base_url}/embed",
+                json={"texts": texts}
+            )
+            response.raise_for_status()
+            return response.json()["embeddings"]
+        except Exception as e:
+            logger.error(f"Embedding request failed: {e}")
+            raise
+    
     async def get_health(self) -> Dict[str, Any]:
         """Check MCP service health"""
         try:
@@ -103,6 +135,10 @@ class LLMProvider:
         temperature: float = 0.1
     ) -> str:
         raise NotImplementedError
+    
+    async def check(self) -> None:
+        """Raise if the provider is unreachable (must not consume tokens)"""
+        return None
 
 
 class OpenAIProvider(LLMProvider):
@@ -140,16 +176,25 @@ class OpenAIProvider(LLMProvider):
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
             raise
+    
+    async def check(self) -> None:
+        """Check the API key and model by retrieving the model (free call)"""
+        await self.client.models.retrieve(self.model)
 
 
 class VertexAIProvider(LLMProvider):
     """Vertex AI LLM provider"""
     
     def __init__(self, project_id: str, location: str = "us-central1", model: str = "gemini-1.5-flash"):
+        from vertexai.generative_models import GenerativeModel
+        
         aiplatform.init(project=project_id, location=location)
         self.model_name = model
         self.project_id = project_id
         self.location = location
+        # Created once so its prediction client (and gRPC channel) is
+        # reused across requests
+        self.model = GenerativeModel(self.model_name)
     
     async def generate_response(
         self, 
@@ -158,9 +203,7 @@ class VertexAIProvider(LLMProvider):
         temperature: float = 0.1
     ) -> str:
         try:
-            from vertexai.generative_models import GenerativeModel, GenerationConfig
-            
-            model = GenerativeModel(self.model_name)
+            from vertexai.generative_models import GenerationConfig
             
             generation_config = GenerationConfig(
                 max_output_tokens=max_tokens,
@@ -175,7 +218,7 @@ Format tes réponses avec des citations claires des sources."""
             
             full_prompt = f"{system_instruction}\n\n{prompt}"
             
-            response = await model.generate_content_async(
+            response = await self.model.generate_content_async(
                 full_prompt,
                 generation_config=generation_config
             )
@@ -185,6 +228,10 @@ Format tes réponses avec des citations claires des sources."""
         except Exception as e:
             logger.error(f"Vertex AI error: {e}")
             raise
+    
+    async def check(self) -> None:
+        """Check credentials and model access with a token count (free call)"""
+        await self.model.count_tokens_async("ping")
 
 
 class DocPilotAgent(ObservabilityMixin):
@@ -195,7 +242,8 @@ class DocPilotAgent(ObservabilityMixin):
         mcp_url: str,
         llm_provider: LLMProvider,
         min_context_chunks: int = 2,
-        max_context_length: int = 8000
+        max_context_length: int = 8000,
+        answer_cache: Optional[SemanticQueryCache] = None
     ):
         super().__init__()
         self.mcp_client = MCPClient(mcp_url)
@@ -203,6 +251,10 @@ class DocPilotAgent(ObservabilityMixin):
         self.llm_provider_name = getattr(llm_provider, '__class__.__name__', 'unknown')
         self.min_context_chunks = min_context_chunks
         self.max_context_length = max_context_length
+        # Answers to near-duplicate questions asked with the same filters.
+        # Off unless a cache is passed in: every miss costs an /embed round
+        # trip before the /search-by-vector call
+        self.answer_cache = answer_cache if answer_cache is not None else SemanticQueryCache(capacity=0)
     
     def _build_rag_prompt(
         self, 
@@ -283,12 +335,20 @@ Réponse:"""
     async def ask(
         self, 
         question: str, 
-        filters: Optional[SearchFilter] = None
+        filters: Optional[SearchFilter] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> AgentResponse:
-        """Main method to ask a question and get an AI response with observability"""
+        """
+        Main method to ask a question and get an AI response with observability
+        
+        A precomputed query_embedding (e.g. for example questions) lets the
+        search skip embedding the question. When the answer cache is enabled
+        the question is embedded up front, and a near-duplicate of a recently
+        answered question is served without searching or calling the LLM.
+        """
         
         # Generate trace ID for this request
-        trace_id = str(uuid.uuid4())
+        trace_id = uuid.uuid4().hex
         
         # Use default filters if none provided
         if filters is None:
@@ -302,8 +362,45 @@ Réponse:"""
         try:
             # Search for relevant documents
             timing_context["search_start"] = time.time()
+            
+            cache_params = None
+            cached = None
+            if self.answer_cache.capacity > 0:
+                # The cache is an optimization: if the question can't be
+                # embedded, fall through to a plain /search without caching
+                try:
+                    cache_embedding = query_embedding
+                    if cache_embedding is None:
+                        cache_embedding = (await self.mcp_client.embed_texts([question]))[0]
+                    cache_key = astuple(filters)
+                    cached = self.answer_cache.get(cache_embedding, cache_key)
+                    query_embedding, cache_params = cache_embedding, cache_key
+                except Exception as e:
+                    logger.warning(f"[{trace_id}] Answer cache unavailable, searching without it: {e!r}")
+                
+                if cached:
+                    entry = cached[0]
+                    response = AgentResponse(
+                        answer=entry["answer"],
+                        sources=[dict(source) for source in entry["sources"]],
+                        trace_id=trace_id,
+                        response_time=0.0,
+                        chunks_scanned=entry["chunks_scanned"],
+                        cache_hit=True
+                    )
+                    
+                    self._complete_request_logging(
+                        trace_id, timing_context, question, filters, response,
+                        0.0, 0.0
+                    )
+                    
+                    start_time = timing_context.get("start_time", 0.0) or 0.0
+                    response.response_time = time.time() - start_time
+                    logger.info(f"[{trace_id}] Answer cache hit in {response.response_time:.3f}s")
+                    return response
+            
             search_results, search_metadata = await self.mcp_client.search_documents(
-                question, filters
+                question, filters, query_embedding
             )
             search_time = self._log_search_timing(trace_id, timing_context, len(search_results))
             
@@ -364,6 +461,14 @@ Réponse:"""
                 fallback_used=fallback_used
             )
             
+            # Only grounded answers are reused
+            if cache_params is not None and not fallback_used:
+                self.answer_cache.put(query_embedding, cache_params, [{
+                    "answer": ai_response,
+                    "sources": sources,
+                    "chunks_scanned": chunks_scanned
+                }])
+            
             # Complete logging
             self._complete_request_logging(
                 trace_id, timing_context, question, filters, response, 
@@ -406,21 +511,88 @@ Réponse:"""
             
             return response
     
-    async def health_check(self) -> Dict[str, Any]:
-        """Check system health"""
-        try:
-            mcp_health = await self.mcp_client.get_health()
-            return {
-                "status": "healthy",
-                "mcp_service": mcp_health,
-                "agent": "ready"
-            }
-        except Exception as e:
+    async def ask_batch(
+        self,
+        items: List[Tuple[str, Optional[SearchFilter]]]
+    ) -> List[AgentResponse]:
+        """
+        Answer several questions at once
+        
+        All questions are embedded in a single /embed request, then searched
+        by vector and answered concurrently. If the batch embedding fails,
+        each question falls back to a regular ask().
+        """
+        if not items:
+            return []
+        
+        embeddings: List[Optional[List[float]]] = [None] * len(items)
+        batch_used = False
+        if len(items) > 1:
+            try:
+                embeddings = await self.mcp_client.embed_texts([question for question, _ in items])
+                batch_used = True
+            except Exception as e:
+                logger.warning(f"Batch embedding failed, embedding questions individually: {e}")
+        
+        responses = await asyncio.gather(*(
+            self.ask(question, filters, embedding)
+            for (question, filters), embedding in zip(items, embeddings)
+        ))
+        
+        for response in responses:
+            response.batch_used = batch_used
+        
+        return list(responses)
+    
+    async def warmup(self) -> None:
+        """
+        Open MCP and LLM connections before the first question
+        
+        Runs a minimal search (which also warms the service's embedding
+        client and DB pool) and the provider check concurrently. Nothing is
+        recorded in the session metrics and failures are only logged.
+        """
+        results = await asyncio.gather(
+            self.mcp_client.search_documents("warmup", SearchFilter(top_k=1)),
+            self.llm_provider.check(),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Warmup step failed: {result!r}")
+    
+    async def health_check(self, llm_timeout: float = 10.0) -> Dict[str, Any]:
+        """
+        Check system health
+        
+        The MCP service and the LLM provider are probed concurrently. The
+        overall status follows the MCP service; an unreachable LLM marks
+        the agent as degraded.
+        """
+        mcp_health, llm_check = await asyncio.gather(
+            self.mcp_client.get_health(),
+            asyncio.wait_for(self.llm_provider.check(), timeout=llm_timeout),
+            return_exceptions=True
+        )
+        
+        if isinstance(mcp_health, Exception):
             return {
                 "status": "unhealthy",
-                "error": str(e),
+                "error": str(mcp_health),
                 "agent": "error"
             }
+        
+        health = {
+            "status": "healthy",
+            "mcp_service": mcp_health,
+            "agent": "ready"
+        }
+        if isinstance(llm_check, Exception):
+            logger.warning(f"LLM provider check failed: {llm_check!r}")
+            health["agent"] = "degraded"
+            health["llm_error"] = str(llm_check) or type(llm_check).__name__
+        
+        return health
     
     async def close(self):
         """Close resources"""
@@ -456,4 +628,12 @@ def create_agent(
     else:
         raise ValueError(f"Unsupported LLM provider: {llm_provider}")
     
+    # Semantic answer cache, sized per deployment (off by default, capacity 0
+    # disables it)
+    kwargs.setdefault("answer_cache", SemanticQueryCache(
+        capacity=int(os.getenv("ANSWER_CACHE_SIZE", "0")),
+        threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+        ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "300"))
+    ))
+    
     return DocPilotAgent(mcp_url, llm, **kwargs)
\ No newline at end of file
@@ -7,7 +7,7 @@ from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import HALFVEC
 
 Base = declarative_base()
 
@@ -42,8 +42,9 @@ class Chunk(Base):
     text = Column(Text, nullable=False)   # chunk text content
     
     # Vector embedding - adjust dimension based on model
-    # text-embedding-004 uses 768 dimensions
-    embedding = Column(Vector(768), nullable=True)
+    # text-embedding-004 uses 768 dimensions, stored as fp16 (halfvec)
+    # to halve table, index and scan size
+    embedding = Column(HALFVEC(768), nullable=True)
     
     # Metadata as JSON
     chunk_metadata = Column(JSONB, nullable=True)
@@ -55,12 +56,29 @@ class Chunk(Base):
         return f"<Chunk(id={self.id}, doc_id={self.doc_id}, text_preview='{self.text[:50]}...')>"
 
 
+class EmbeddingCache(Base):
+    """Embeddings keyed by SHA256 of the chunk text, reused across re-indexing"""
+    
+    __tablename__ = "embedding_cache"
+    
+    content_hash = Column(Text, primary_key=True)  # SHA256 hash of chunk text
+    embedding = Column(HALFVEC(768), nullable=False)  # same fp16 storage as chunks
+    created_at = Column(DateTime(timezone=True), default=func.now())
+    
+    def __repr__(self):
+        return f"<EmbeddingCache(content_hash='{self.content_hash[:12]}...')>"
+
+
 # Index for HNSW vector similarity search
-# HNSW is recommended for pgvector >= 0.5
+# HNSW is recommended for pgvector >= 0.5; parameters are for a new (small)
+# corpus, DatabaseService rebuilds the index as the corpus grows
 vector_index = Index(
     "chunks_embedding_hnsw_idx",
     Chunk.embedding,
     postgresql_using="hnsw",
     postgresql_with={"m": 16, "ef_construction": 64},
-    postgresql_ops={"embedding": "vector_l2_ops"}
-)
\ No newline at end of file
+    postgresql_ops={"embedding": "halfvec_cosine_ops"}
+)
+
+# Index for chunk lookups and cascading deletes by document
+doc_id_index = Index("chunks_doc_id_idx", Chunk.doc_id)
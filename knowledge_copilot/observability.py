@@ -3,18 +3,75 @@ DocPilot Observability - Logs structurés et métriques
 Jour 5: Agent + CLI/mini-UI & Qualité
 """
 
+import math
+import sys
 import time
 import uuid
-from typing import Dict, Any, Optional, Union
+from typing import Dict, Any, Optional, Tuple, Union
 from dataclasses import dataclass, asdict
 from datetime import datetime, timezone
+from collections import OrderedDict
+import orjson
 from loguru import logger
 
+try:
+    from prometheus_client import Counter, Histogram
+except ImportError:  # Prometheus export is optional (e.g. slim Streamlit images)
+    Counter = Histogram = None
 
-@dataclass
+
+# Process-wide Prometheus metrics, fed by MetricsCollector.record_request
+if Counter is not None:
+    AGENT_REQUESTS = Counter(
+        "agent_requests_total",
+        "Agent requests by outcome",
+        ["outcome"]
+    )
+    AGENT_REQUEST_DURATION = Histogram(
+        "agent_request_duration_seconds",
+        "End-to-end agent request duration",
+        buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0)
+    )
+    AGENT_SEARCH_DURATION = Histogram(
+        "agent_search_duration_seconds",
+        "Document search duration per agent request",
+        buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    )
+    AGENT_LLM_DURATION = Histogram(
+        "agent_llm_duration_seconds",
+        "LLM generation duration per agent request",
+        buckets=(0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0)
+    )
+    AGENT_CHUNKS_SCANNED = Histogram(
+        "agent_chunks_scanned",
+        "Chunks returned by the search per agent request",
+        buckets=(0, 1, 2, 3, 5, 10, 20, 50)
+    )
+else:
+    AGENT_REQUESTS = AGENT_REQUEST_DURATION = AGENT_SEARCH_DURATION = None
+    AGENT_LLM_DURATION = AGENT_CHUNKS_SCANNED = None
+
+
+def _export_prometheus(metrics: "RequestMetrics"):
+    """Feed a finished request into the Prometheus metrics, if available"""
+    if AGENT_REQUESTS is None:
+        return
+    
+    if metrics.error:
+        outcome = "error"
+    else:
+        outcome = "fallback" if metrics.fallback_used else "success"
+    AGENT_REQUESTS.labels(outcome=outcome).inc()
+    AGENT_REQUEST_DURATION.observe(metrics.response_time)
+    AGENT_SEARCH_DURATION.observe(metrics.search_time)
+    AGENT_LLM_DURATION.observe(metrics.llm_time)
+    AGENT_CHUNKS_SCANNED.observe(metrics.chunks_scanned)
+
+
+@dataclass(slots=True)
 class RequestMetrics:
     """Metrics for a request"""
-    trace_id: str
+    trace_id: str  # 32-char hex (uuid4().hex)
     timestamp: str
     question: str
     response_time: float
@@ -32,10 +89,15 @@ class RequestMetrics:
     error: Optional[str] = None
     user_id: Optional[str] = None
     session_id: Optional[str] = None
+    question_preview: str = ""  # question truncated to 50 chars for stats
 
 
 class StructuredLogger:
-    """Structured logger for DocPilot using loguru"""
+    """Structured logger for DocPilot using loguru
+
+    Per-request events (search, LLM, completion, error) expect trace_id and
+    service to be bound via logger.contextualize for the request duration.
+    """
     
     def __init__(self, service_name: str = "docpilot-agent"):
         self.service_name = service_name
@@ -60,8 +122,6 @@ class StructuredLogger:
             "Search completed",
             extra={
                 "event": "search_completed",
-                "service": self.service_name,
-                "trace_id": trace_id,
                 "chunks_found": chunks_found,
                 "search_time_seconds": search_time,
                 "timestamp": datetime.now(timezone.utc).isoformat()
@@ -74,8 +134,6 @@ class StructuredLogger:
             "LLM completed",
             extra={
                 "event": "llm_completed",
-                "service": self.service_name,
-                "trace_id": trace_id,
                 "llm_time_seconds": llm_time,
                 "provider": provider,
                 "timestamp": datetime.now(timezone.utc).isoformat()
@@ -88,7 +146,6 @@ class StructuredLogger:
             "Request completed",
             extra={
                 "event": "request_completed",
-                "service": self.service_name,
                 **asdict(metrics)
             }
         )
@@ -99,8 +156,6 @@ class StructuredLogger:
             "Request error",
             extra={
                 "event": "request_error",
-                "service": self.service_name,
-                "trace_id": trace_id,
                 "error": error,
                 "error_type": error_type,
                 "timestamp": datetime.now(timezone.utc).isoformat()
@@ -155,6 +210,8 @@ class MetricsCollector:
         else:
             self.session_stats["successful_requests"] += 1
         
+        _export_prometheus(metrics)
+        
         self.session_stats["total_response_time"] += metrics.response_time
         self.session_stats["total_search_time"] += metrics.search_time
         self.session_stats["total_llm_time"] += metrics.llm_time
@@ -184,6 +241,10 @@ class MetricsCollector:
             stats["avg_chunks_scanned"] = stats["total_chunks_scanned"] / stats["total_requests"]
             stats["success_rate"] = stats["successful_requests"] / stats["total_requests"]
             stats["fallback_rate"] = stats["fallback_count"] / stats["total_requests"]
+            
+            # Nearest-rank p95 over this session's requests
+            response_times = sorted(m.response_time for m in self.metrics)
+            stats["p95_response_time"] = response_times[max(0, math.ceil(0.95 * len(response_times)) - 1)]
         
         return stats
     
@@ -199,11 +260,20 @@ class ObservabilityMixin:
         super().__init__(*args, **kwargs)
         self.structured_logger = StructuredLogger()
         self.metrics_collector = MetricsCollector()
-        self.session_id = str(uuid.uuid4())
+        self.session_id = uuid.uuid4().hex
+        # Filter dicts memoized per filters object, keyed by id(filters)
+        self._filter_dict_cache: "OrderedDict[int, Tuple[Any, Dict[str, Any]]]" = OrderedDict()
+        self._filter_dict_cache_size = 128
     
-    def _start_request_logging(self, trace_id: str, question: str, filters) -> Dict[str, Optional[float]]:
-        """Start request logging and return timing context"""
-        # Log request start
+    def _get_filter_dict(self, filters) -> Dict[str, Any]:
+        """Get the loggable dict for a filters object, memoized per object"""
+        key = id(filters)
+        cached = self._filter_dict_cache.get(key)
+        # The object is kept in the entry so a recycled id() never yields a stale dict
+        if cached is not None and cached[0] is filters:
+            self._filter_dict_cache.move_to_end(key)
+            return cached[1]
+        
         filter_dict = {
             "source": getattr(filters, 'source', None),
             "repo": getattr(filters, 'repo', None),
@@ -212,6 +282,25 @@ class ObservabilityMixin:
             "similarity_threshold": getattr(filters, 'similarity_threshold', 0.7)
         }
         
+        self._filter_dict_cache[key] = (filters, filter_dict)
+        if len(self._filter_dict_cache) > self._filter_dict_cache_size:
+            self._filter_dict_cache.popitem(last=False)
+        
+        return filter_dict
+    
+    def _start_request_logging(self, trace_id: str, question: str, filters) -> Dict[str, Any]:
+        """Start request logging and return timing context"""
+        # Bind request identifiers to every log record until the request completes
+        log_context = logger.contextualize(
+            trace_id=trace_id,
+            session_id=self.session_id,
+            service=self.structured_logger.service_name
+        )
+        log_context.__enter__()
+        
+        # Log request start
+        filter_dict = self._get_filter_dict(filters)
+        
         self.structured_logger.log_request_start(trace_id, question, filter_dict)
         
         return {
@@ -219,10 +308,11 @@ class ObservabilityMixin:
             "search_start": None,
             "search_end": None,
             "llm_start": None,
-            "llm_end": None
+            "llm_end": None,
+            "log_context": log_context
         }
     
-    def _log_search_timing(self, trace_id: str, timing_context: Dict[str, Optional[float]], chunks_found: int):
+    def _log_search_timing(self, trace_id: str, timing_context: Dict[str, Any], chunks_found: int):
         """Log search timing"""
         timing_context["search_end"] = time.time()
         search_start = timing_context.get("search_start", 0.0) or 0.0
@@ -233,7 +323,7 @@ class ObservabilityMixin:
         
         return search_time
     
-    def _log_llm_timing(self, trace_id: str, timing_context: Dict[str, Optional[float]], provider: str):
+    def _log_llm_timing(self, trace_id: str, timing_context: Dict[str, Any], provider: str):
         """Log LLM timing"""
         timing_context["llm_end"] = time.time()
         llm_start = timing_context.get("llm_start", 0.0) or 0.0
@@ -247,7 +337,7 @@ class ObservabilityMixin:
     def _complete_request_logging(
         self,
         trace_id: str,
-        timing_context: Dict[str, Optional[float]],
+        timing_context: Dict[str, Any],
         question: str,
         filters,
         response,
@@ -264,6 +354,7 @@ class ObservabilityMixin:
             trace_id=trace_id,
             timestamp=datetime.now(timezone.utc).isoformat(),
             question=question,
+            question_preview=question[:50] + "..." if len(question) > 50 else question,
             response_time=total_time,
             search_time=search_time,
             llm_time=llm_time,
@@ -286,6 +377,11 @@ class ObservabilityMixin:
         # Record metrics
         self.metrics_collector.record_request(metrics)
         
+        # Release the request logging context
+        log_context = timing_context.pop("log_context", None)
+        if log_context is not None:
+            log_context.__exit__(None, None, None)
+        
         return metrics
     
     def get_observability_stats(self) -> Dict[str, Any]:
@@ -296,7 +392,7 @@ class ObservabilityMixin:
             "recent_requests": [
                 {
                     "trace_id": m.trace_id,
-                    "question": m.question[:50] + "..." if len(m.question) > 50 else m.question,
+                    "question": m.question_preview,
                     "response_time": m.response_time,
                     "chunks_scanned": m.chunks_scanned,
                     "fallback_used": m.fallback_used,
@@ -307,23 +403,44 @@ class ObservabilityMixin:
         }
 
 
+# Color tags only make sense on the console; file sinks get a plain format
+CONSOLE_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
+    "<level>{level: <8}</level> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | "
+    "<level>{message}</level>"
+)
+
+FILE_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} | {message}"
+
+
+def _orjson_format(record) -> str:
+    """Serialize a record to a JSON line with orjson (used by the structured sink)"""
+    extra = dict(record["extra"])
+    fields = extra.pop("extra", None) or {}
+    record["extra"]["_json"] = orjson.dumps(
+        {
+            "time": record["time"].isoformat(),
+            "level": record["level"].name,
+            "message": record["message"],
+            **extra,
+            **fields
+        },
+        default=str
+    ).decode()
+    return "{extra[_json]}\n"
+
+
 def setup_observability_logging(log_level: str = "INFO", log_file: Optional[str] = None):
     """Setup observability logging configuration"""
     
     # Configure loguru for application logs
     logger.remove()
     
-    log_format = (
-        "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
-        "<level>{level: <8}</level> | "
-        "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | "
-        "<level>{message}</level>"
-    )
-    
     # Console logging
     logger.add(
-        lambda msg: print(msg, end=""),
-        format=log_format,
+        sys.stderr,
+        format=CONSOLE_FORMAT,
         level=log_level,
         colorize=True
     )
@@ -332,7 +449,7 @@ def setup_observability_logging(log_level: str = "INFO", log_file: Optional[str]
     if log_file:
         logger.add(
             log_file,
-            format=log_format,
+            format=FILE_FORMAT,
             level=log_level,
             rotation="100 MB",
             retention="7 days",
@@ -344,9 +461,9 @@ def setup_observability_logging(log_level: str = "INFO", log_file: Optional[str]
         structured_log_file = log_file.replace(".log", "_structured.jsonl")
         logger.add(
             structured_log_file,
-            format="{message}",
+            format=_orjson_format,
             level=log_level,
-            serialize=True,
+            enqueue=True,
             rotation="100 MB",
             retention="7 days"
         )
\ No newline at end of file
@@ -3,6 +3,7 @@ RAG (Retrieval-Augmented Generation) service
 Integrates document indexing and semantic search
 """
 
+import asyncio
 from typing import List, Dict, Optional, Any
 from loguru import logger
 
@@ -32,6 +33,12 @@ class RAGService:
             embeddings_service=self.embeddings_service
         )
         
+        # Embedding model info is static for the service lifetime
+        self._embedding_meta = {
+            "embedding_model": self.embeddings_service.model_name,
+            "embedding_dimension": self.embeddings_service.get_embedding_dimension()
+        }
+        
         logger.info("RAG service initialized")
     
     def index_document(
@@ -64,8 +71,7 @@ class RAGService:
             doc_metadata = {
                 **(metadata or {}),
                 "indexed_by": "rag_service",
-                "embedding_model": self.embeddings_service.model_name,
-                "embedding_dimension": self.embeddings_service.get_embedding_dimension()
+                **self._embedding_meta
             }
             
             document_id = self.database_service.index_document(
@@ -84,12 +90,41 @@ class RAGService:
             logger.error(f"Error indexing document: {e}")
             raise
     
+    async def index_document_async(
+        self,
+        content: str,
+        source: Optional[str] = None,
+        uri: Optional[str] = None,
+        title: Optional[str] = None,
+        mime: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> int:
+        """
+        Index a document without blocking the event loop
+        
+        The blocking DB/embedding work runs in a worker thread, so several
+        documents can be indexed concurrently with asyncio.gather.
+        
+        Returns:
+            Document ID
+        """
+        return await asyncio.to_thread(
+            self.index_document,
+            content=content,
+            source=source,
+            uri=uri,
+            title=title,
+            mime=mime,
+            metadata=metadata
+        )
+    
     def search(
         self,
         query: str,
         limit: int = 10,
         similarity_threshold: Optional[float] = None,
-        source_filter: Optional[str] = None
+        source_filter: Optional[str] = None,
+        ef_search: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """
         Perform semantic search across indexed documents
@@ -99,6 +134,7 @@ class RAGService:
             limit: Maximum number of results
             similarity_threshold: Minimum similarity score (0.0 to 1.0)
             source_filter: Optional filter by document source
+            ef_search: Optional HNSW ef_search override (recall/latency trade-off)
         
         Returns:
             List of search results with similarity scores and metadata
@@ -110,32 +146,94 @@ class RAGService:
             results = self.database_service.search(
                 query=query,
                 limit=limit,
-                similarity_threshold=similarity_threshold
+                similarity_threshold=similarity_threshold,
+                ef_search=ef_search
             )
             
-            # Apply source filter if specified
-            if source_filter:
-                results = [
-                    result for result in results
-                    if result.get("document", {}).get("source") == source_filter
-                ]
+            return self._finalize_results(results, query, similarity_threshold, source_filter)
             
-            # Add query context to results
-            for result in results:
-                result["query"] = query
-                result["search_metadata"] = {
-                    "similarity_threshold": similarity_threshold,
-                    "source_filter": source_filter,
-                    "total_results": len(results)
-                }
+        except Exception as e:
+            logger.error(f"Error performing search: {e}")
+            raise
+    
+    def search_by_vector(
+        self,
+        embedding: List[float],
+        query: Optional[str] = None,
+        limit: int = 10,
+        similarity_threshold: Optional[float] = None,
+        source_filter: Optional[str] = None,
+        ef_search: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Perform semantic search with a precomputed query embedding
+        
+        Args:
+            embedding: Query embedding (same model as the indexed chunks)
+            query: Optional query text, echoed in the results
+            limit: Maximum number of results
+            similarity_threshold: Minimum similarity score (0.0 to 1.0)
+            source_filter: Optional filter by document source
+            ef_search: Optional HNSW ef_search override (recall/latency trade-off)
+        
+        Returns:
+            List of search results with similarity scores and metadata
+        """
+        try:
+            logger.info(f"Searching by vector (limit: {limit})")
             
-            logger.info(f"Found {len(results)} results")
-            return results
+            results = self.database_service.search_by_embedding(
+                embedding,
+                limit=limit,
+                similarity_threshold=similarity_threshold,
+                ef_search=ef_search
+            )
+            
+            return self._finalize_results(results, query, similarity_threshold, source_filter)
             
         except Exception as e:
             logger.error(f"Error performing search: {e}")
             raise
     
+    def _finalize_results(
+        self,
+        results: List[Dict[str, Any]],
+        query: Optional[str],
+        similarity_threshold: Optional[float],
+        source_filter: Optional[str]
+    ) -> List[Dict[str, Any]]:
+        """Apply the source filter and attach query context to search results"""
+        # Apply source filter if specified
+        if source_filter:
+            results = [
+                result for result in results
+                if result.get("document", {}).get("source") == source_filter
+            ]
+        
+        # Add query context to results
+        for result in results:
+            result["query"] = query
+            result["search_metadata"] = {
+                "similarity_threshold": similarity_threshold,
+                "source_filter": source_filter,
+                "total_results": len(results)
+            }
+        
+        logger.info(f"Found {len(results)} results")
+        return results
+    
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts with the same model used for indexing
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            Embedding vectors, in the same order as texts
+        """
+        return self.embeddings_service.get_embeddings_batched(texts)
+    
     def get_document_by_id(self, document_id: int) -> Optional[Dict[str, Any]]:
         """
         Get document metadata by ID
@@ -189,8 +287,7 @@ class RAGService:
             
             stats = {
                 **db_stats,
-                "embedding_model": self.embeddings_service.model_name,
-                "embedding_dimension": self.embeddings_service.get_embedding_dimension(),
+                **self._embedding_meta,
                 "service_status": "active"
             }
             
@@ -241,6 +338,55 @@ class RAGService:
         
         logger.info(f"Batch indexing completed: {len(document_ids)} documents indexed")
         return document_ids
+    
+    async def batch_index_documents_async(
+        self,
+        documents: List[Dict[str, Any]],
+        max_concurrency: int = 8
+    ) -> List[int]:
+        """
+        Index multiple documents concurrently
+        
+        Each document runs in a worker thread; its chunk embeddings are
+        already batched concurrently, so max_concurrency bounds both DB
+        connections and in-flight embedding requests.
+        
+        Args:
+            documents: List of document dictionaries with 'content' and optional metadata
+            max_concurrency: Maximum number of documents indexed at once
+            
+        Returns:
+            List of document IDs, in input order (failed documents are skipped)
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def _index(doc: Dict[str, Any]) -> int:
+            async with semaphore:
+                return await self.index_document_async(
+                    content=doc["content"],
+                    source=doc.get("source"),
+                    uri=doc.get("uri"),
+                    title=doc.get("title"),
+                    mime=doc.get("mime"),
+                    metadata=doc.get("metadata")
+                )
+        
+        # Start the longest documents first so one large document doesn't
+        # finish alone at the end
+        order = sorted(range(len(documents)), key=lambda i: len(documents[i]["content"]), reverse=True)
+        tasks = {i: asyncio.ensure_future(_index(documents[i])) for i in order}
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        
+        document_ids = []
+        for i in range(len(documents)):
+            error = tasks[i].exception()
+            if error is not None:
+                logger.error(f"Error indexing document in batch: {error}")
+                continue
+            document_ids.append(tasks[i].result())
+        
+        logger.info(f"Batch indexing completed: {len(document_ids)} documents indexed")
+        return document_ids
 
 
 def create_rag_service(
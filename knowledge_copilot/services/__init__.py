@@ -2,17 +2,179 @@
 Database service for document indexing and vector search using pgvector
 """
 
+import io
 import os
 import hashlib
-from typing import List, Dict, Optional
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import IntegrityError
+import struct
+from contextlib import contextmanager
+from itertools import islice
+from typing import List, Dict, Optional, Tuple, Union
+from psycopg2.extras import execute_values
+from sqlalchemy import Integer, bindparam, create_engine, func, literal_column, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
 from loguru import logger
+import numpy as np
+import orjson
 
-from ..models import Base, Document, Chunk
+from ..models import Base, Document, Chunk, EmbeddingCache
 from ..utils.embeddings import VertexAIEmbeddings, create_embeddings_service
-from ..utils.chunking import chunk_text
+from ..utils.chunking import iter_chunks
+from ..utils.semantic_cache import SemanticQueryCache
+
+
+# Characters encoded per hash update for large documents
+HASH_BLOCK_CHARS = 64 * 1024
+
+# Upper bound pgvector accepts for hnsw.ef_search
+HNSW_EF_SEARCH_MAX = 1000
+
+# With a similarity threshold the HNSW scan is post-filtered, so it keeps at
+# least this many candidates per requested row
+THRESHOLD_EF_SEARCH_FACTOR = 4
+
+# Session-level advisory lock serializing schema changes across workers
+# and the migrate step ("docpilot" as a bigint)
+SCHEMA_LOCK_ID = int.from_bytes(b"docpilot", "big")
+
+# PostgreSQL binary COPY framing
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_COPY_TRAILER = struct.pack(">h", -1)
+# Field count, then the 4-byte int4 doc_id field
+_CHUNK_ROW_PREFIX = struct.Struct(">hii")
+_FIELD_LENGTH = struct.Struct(">i")
+
+
+def _to_halfvec_text(embedding) -> str:
+    """Format an embedding as a halfvec literal, rounded to fp16 client-side"""
+    # str() of a float16 scalar is its shortest repr: ~2.5x smaller and faster
+    # to build than the float repr pgvector's bind processor emits
+    return "[" + ",".join(map(str, np.asarray(embedding, dtype=np.float16))) + "]"
+
+
+def _to_halfvec_binary(embedding) -> bytes:
+    """Encode an embedding in halfvec's binary wire format (halfvec_send)"""
+    values = np.asarray(embedding, dtype=">f2")
+    return struct.pack(">HH", values.shape[0], 0) + values.tobytes()
+
+
+def configure_hnsw_params(n: int) -> Dict[str, int]:
+    """
+    Pick HNSW parameters for a corpus size
+    
+    Args:
+        n: Number of chunks
+    
+    Returns:
+        Dictionary with m, ef_construction and ef_search
+    """
+    if n < 100_000:
+        return {"m": 16, "ef_construction": 64, "ef_search": 40}
+    if n < 1_000_000:
+        return {"m": 24, "ef_construction": 100, "ef_search": 100}
+    return {"m": 32, "ef_construction": 128, "ef_search": 200}
+
+
+@contextmanager
+def _schema_lock(engine: Engine):
+    """Yield an AUTOCOMMIT connection holding the schema advisory lock"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key);"), {"key": SCHEMA_LOCK_ID})
+        try:
+            yield conn
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key);"), {"key": SCHEMA_LOCK_ID})
+
+
+def _create_schema(conn: Connection):
+    """Enable pgvector and create missing tables (with their indexes)"""
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
+    Base.metadata.create_all(bind=conn)
+
+
+def _legacy_embedding_tables(conn: Connection) -> List[str]:
+    """Tables whose embedding column predates the switch to halfvec(768)"""
+    return [
+        table for table in ("chunks", "embedding_cache")
+        if conn.execute(text(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+            f"WHERE attrelid = '{table}'::regclass AND attname = 'embedding';"
+        )).scalar() == "vector(768)"
+    ]
+
+
+def _hnsw_index_state(conn: Connection, chunk_count: int) -> Optional[str]:
+    """
+    Compare chunks_embedding_hnsw_idx with the parameters for the corpus size
+    
+    Returns:
+        None if it matches, "missing", "opclass" or "params" otherwise
+    """
+    params = configure_hnsw_params(chunk_count)
+    existing = conn.execute(text(
+        "SELECT c.reloptions, pg_get_indexdef(c.oid) FROM pg_class c "
+        "WHERE c.relname = 'chunks_embedding_hnsw_idx';"
+    )).first()
+    
+    if existing is None:
+        return "missing"
+    reloptions, indexdef = existing
+    if "halfvec_cosine_ops" not in indexdef:
+        return "opclass"
+    if set(reloptions or []) != {f"m={params['m']}", f"ef_construction={params['ef_construction']}"}:
+        return "params"
+    return None
+
+
+def _configure_hnsw_index(conn: Connection, chunk_count: int):
+    """
+    Create the cosine HNSW index on chunks.embedding with parameters sized
+    for the corpus, rebuilding it when they differ
+    
+    conn must be in AUTOCOMMIT mode: CREATE/REINDEX CONCURRENTLY cannot run
+    inside a transaction.
+    """
+    state = _hnsw_index_state(conn, chunk_count)
+    if state is None:
+        logger.info(f"HNSW index matches corpus size ({chunk_count} chunks)")
+        return
+    
+    params = configure_hnsw_params(chunk_count)
+    m, ef_construction = int(params["m"]), int(params["ef_construction"])
+    
+    if state == "opclass":
+        # A different opclass needs a new index, not a rebuild
+        conn.execute(text("DROP INDEX CONCURRENTLY chunks_embedding_hnsw_idx;"))
+        state = "missing"
+    
+    logger.info(
+        f"Building HNSW index for {chunk_count} chunks: "
+        f"m={m}, ef_construction={ef_construction}"
+    )
+    
+    # Parallel build with enough memory to keep the graph in RAM
+    conn.execute(text("SET max_parallel_maintenance_workers = 7;"))
+    conn.execute(text("SET maintenance_work_mem = '2GB';"))
+    try:
+        if state == "missing":
+            conn.execute(text(
+                "CREATE INDEX CONCURRENTLY chunks_embedding_hnsw_idx "
+                "ON chunks USING hnsw (embedding halfvec_cosine_ops) "
+                f"WITH (m = {m}, ef_construction = {ef_construction});"
+            ))
+        else:
+            # Searches keep using the old index until the rebuild swaps in
+            conn.execute(text(
+                "ALTER INDEX chunks_embedding_hnsw_idx "
+                f"SET (m = {m}, ef_construction = {ef_construction});"
+            ))
+            conn.execute(text("REINDEX INDEX CONCURRENTLY chunks_embedding_hnsw_idx;"))
+    finally:
+        # Don't leak the build settings into the session
+        conn.execute(text("RESET max_parallel_maintenance_workers;"))
+        conn.execute(text("RESET maintenance_work_mem;"))
 
 
 class DatabaseService:
@@ -21,7 +183,13 @@ class DatabaseService:
     def __init__(
         self,
         database_url: str,
-        embeddings_service: Optional[VertexAIEmbeddings] = None
+        embeddings_service: Optional[VertexAIEmbeddings] = None,
+        ef_search: Optional[int] = None,
+        pool_size: int = 20,
+        max_overflow: int = 20,
+        search_timeout_ms: int = 5000,
+        prefilter_candidates: Optional[int] = None,
+        query_cache: Optional[SemanticQueryCache] = None
     ):
         """
         Initialize database service
@@ -29,37 +197,203 @@ class DatabaseService:
         Args:
             database_url: PostgreSQL connection URL
             embeddings_service: Optional embeddings service instance
+            ef_search: HNSW candidate list size used at query time (recall/latency
+                trade-off); defaults to the value picked for the corpus size
+            pool_size: Number of persistent pooled connections
+            max_overflow: Extra connections allowed under burst load
+            search_timeout_ms: Statement timeout applied to search queries only
+            prefilter_candidates: If set, search first takes this many candidates by
+                Hamming distance on binary-quantized embeddings, then reranks them
+                exactly (only worth it on very large corpora, >1M chunks)
+            query_cache: Semantic cache for search results (defaults to SemanticQueryCache())
         """
         self.database_url = database_url
-        self.engine = create_engine(database_url)
+        self.ef_search = ef_search
+        self.search_timeout_ms = search_timeout_ms
+        self.prefilter_candidates = prefilter_candidates
+        self.engine = create_engine(
+            database_url,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=True,  # drop connections closed by Cloud SQL / idle timeouts
+            pool_recycle=1800,
+            connect_args={"application_name": "docpilot"}  # visible in pg_stat_activity
+        )
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
         
         # Initialize embeddings service
         self.embeddings_service = embeddings_service or create_embeddings_service()
         
+        # Cache of recent search results keyed by query embedding
+        self.query_cache = query_cache or SemanticQueryCache()
+        
         # Initialize database
         self._init_database()
     
     def _init_database(self):
-        """Initialize database with tables and pgvector extension"""
+        """
+        Create missing tables and check that the schema is migrated
+        
+        Only cheap, idempotent DDL runs here, serialized across workers by an
+        advisory lock. Column rewrites and vector index builds are left to
+        migrate_database (python main.py migrate / python app.py migrate).
+        """
         try:
-            with self.engine.connect() as conn:
-                # Enable pgvector extension
-                conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
-                conn.commit()
-                logger.info("Enabled pgvector extension")
-            
-            # Create tables
-            Base.metadata.create_all(bind=self.engine)
-            logger.info("Database tables created/verified")
+            with _schema_lock(self.engine) as conn:
+                _create_schema(conn)
+                logger.info("Database tables created/verified")
+                
+                legacy_tables = _legacy_embedding_tables(conn)
+                if legacy_tables:
+                    raise RuntimeError(
+                        f"{', '.join(legacy_tables)} still store vector(768) embeddings; "
+                        "run `python main.py migrate` (or `python app.py migrate`) to convert them to halfvec(768)"
+                    )
+                
+                chunk_count = conn.execute(text("SELECT count(*) FROM chunks;")).scalar()
+                if self.ef_search is None:
+                    self.ef_search = configure_hnsw_params(chunk_count)["ef_search"]
+                
+                state = _hnsw_index_state(conn, chunk_count)
+                if state is not None:
+                    logger.warning(
+                        f"HNSW index on chunks.embedding is not tuned for {chunk_count} chunks "
+                        f"({state}); run `python main.py migrate` (or `python app.py migrate`) to rebuild it"
+                    )
+                
+                if self.prefilter_candidates and conn.execute(text(
+                    "SELECT to_regclass('chunks_embedding_bits_hnsw_idx');"
+                )).scalar() is None:
+                    logger.warning(
+                        "Binary prefilter enabled without chunks_embedding_bits_hnsw_idx; "
+                        "run `python main.py migrate` (or `python app.py migrate`) to build it"
+                    )
             
         except Exception as e:
             logger.error(f"Error initializing database: {e}")
             raise
     
-    def _calculate_content_hash(self, content: str) -> str:
-        """Calculate SHA256 hash of content"""
-        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+    def _calculate_content_hash(self, content: Union[str, bytes]) -> str:
+        """
+        Calculate SHA256 hash of content
+        
+        Large strings are encoded and fed to the hash block by block, so no
+        full UTF-8 copy of the document is held in memory. The digest is the
+        same as hashing content.encode('utf-8') in one go.
+        """
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return hashlib.sha256(content).hexdigest()
+        
+        if len(content) <= HASH_BLOCK_CHARS:
+            return hashlib.sha256(content.encode('utf-8')).hexdigest()
+        
+        digest = hashlib.sha256()
+        for i in range(0, len(content), HASH_BLOCK_CHARS):
+            digest.update(content[i:i + HASH_BLOCK_CHARS].encode('utf-8'))
+        return digest.hexdigest()
+    
+    def _get_chunk_embeddings(self, db: Session, texts: List[str]) -> List[bytes]:
+        """
+        Get embeddings for chunk texts, reusing cached ones by content hash
+        
+        Only texts missing from the embedding_cache table are sent to the
+        embeddings service; new embeddings are written back to the cache in
+        a short transaction of their own.
+        Both tables store halfvec, so cached embeddings are read back in
+        halfvec's binary format and passed to COPY without being parsed.
+        
+        Args:
+            db: Active session
+            texts: Chunk texts
+            
+        Returns:
+            Binary halfvec values in the same order as texts
+        """
+        hashes = [self._calculate_content_hash(t) for t in texts]
+        
+        cached = {
+            row.content_hash: bytes(row.embedding)
+            for row in db.execute(
+                select(EmbeddingCache.content_hash, func.halfvec_send(EmbeddingCache.embedding).label("embedding"))
+                .where(EmbeddingCache.content_hash.in_(set(hashes)))
+            )
+        }
+        
+        # Embed each missing text once, even if repeated in the document
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+        
+        if missing:
+            new_embeddings = self.embeddings_service.get_embeddings_batched(list(missing.values()))
+            
+            # Concurrent uploads may cache the same chunk, so this stays an
+            # INSERT ... ON CONFLICT rather than a COPY. Rows go in hash order
+            # and commit on their own connection, outside the document
+            # transaction, so concurrent indexers take the row locks in the
+            # same order and hold them only briefly instead of deadlocking
+            cache_rows = sorted(
+                (h, _to_halfvec_text(e)) for h, e in zip(missing.keys(), new_embeddings)
+            )
+            with self.engine.begin() as conn:
+                with conn.connection.cursor() as cursor:
+                    execute_values(
+                        cursor,
+                        "INSERT INTO embedding_cache (content_hash, embedding, created_at) VALUES %s "
+                        "ON CONFLICT (content_hash) DO NOTHING",
+                        cache_rows,
+                        template="(%s, %s::halfvec, now())",
+                        page_size=500
+                    )
+            cached.update(
+                (h, _to_halfvec_binary(e)) for h, e in zip(missing.keys(), new_embeddings)
+            )
+        
+        return [cached[h] for h in hashes]
+    
+    def _insert_chunks(self, db: Session, rows: List[Tuple]) -> None:
+        """
+        Stream chunk rows into the chunks table with a binary COPY
+        
+        Binary COPY skips SQL parsing and per-value text conversion on the
+        server. Runs on the session's own connection so the rows share the
+        transaction of the parent document.
+        
+        Args:
+            db: Active session
+            rows: (doc_id, text, halfvec_binary, metadata) tuples
+        """
+        if not rows:
+            return
+        
+        pack_prefix = _CHUNK_ROW_PREFIX.pack
+        pack_length = _FIELD_LENGTH.pack
+        
+        buffer = io.BytesIO()
+        buffer.write(_COPY_HEADER)
+        for doc_id, chunk, embedding, chunk_metadata in rows:
+            text_bytes = chunk.encode("utf-8")
+            # jsonb binary format is a version byte followed by the JSON text
+            metadata_bytes = b"\x01" + orjson.dumps(chunk_metadata)
+            buffer.write(pack_prefix(4, 4, doc_id))
+            buffer.write(pack_length(len(text_bytes)))
+            buffer.write(text_bytes)
+            buffer.write(pack_length(len(embedding)))
+            buffer.write(embedding)
+            buffer.write(pack_length(len(metadata_bytes)))
+            buffer.write(metadata_bytes)
+        buffer.write(_COPY_TRAILER)
+        buffer.seek(0)
+        
+        raw_connection = db.connection().connection
+        with raw_connection.cursor() as cursor:
+            cursor.copy_expert(
+                "COPY chunks (doc_id, text, embedding, chunk_metadata) FROM STDIN WITH (FORMAT BINARY)",
+                buffer
+            )
     
     def index_document(
         self,
@@ -88,64 +422,75 @@ class DatabaseService:
         
         with self.SessionLocal() as db:
             try:
-                # Check if document already exists
-                existing_doc = db.query(Document).filter(
-                    Document.content_hash == content_hash
-                ).first()
+                # Don't wait for the WAL flush on commit: a crash can lose the
+                # last ingested document, but content_hash dedup makes the
+                # retry idempotent. Scoped to this transaction only
+                db.execute(text("SET LOCAL synchronous_commit = off"))
                 
-                if existing_doc:
-                    logger.info(f"Document already indexed: {existing_doc.id}")
-                    return existing_doc.id
-                
-                # Create new document
-                document = Document(
+                # Insert the document, or find the existing one, in a single
+                # round trip; xmax = 0 only for a freshly inserted row
+                stmt = pg_insert(Document).values(
                     source=source,
                     uri=uri,
                     title=title,
                     mime=mime,
                     content_hash=content_hash
                 )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[Document.content_hash],
+                    set_={"content_hash": stmt.excluded.content_hash}
+                ).returning(Document.id, literal_column("xmax = 0").label("inserted"))
+                document_id, inserted = db.execute(stmt).one()
                 
-                db.add(document)
-                db.flush()  # Get the document ID
+                if not inserted:
+                    db.rollback()
+                    logger.info(f"Document already indexed: {document_id}")
+                    return document_id
                 
-                # Chunk the document
-                chunks = chunk_text(content)
-                logger.info(f"Split document into {len(chunks)} chunks")
+                # Chunk, embed and insert in windows so only one window of
+                # chunk texts is materialized at a time
+                window_size = 500
+                chunk_count = 0
+                chunk_spans = iter_chunks(content)
                 
-                # Process chunks in batches for efficiency
-                batch_size = 10
-                for i in range(0, len(chunks), batch_size):
-                    batch_chunks = chunks[i:i + batch_size]
-                    batch_texts = [chunk['text'] for chunk in batch_chunks]
+                while True:
+                    window = list(islice(chunk_spans, window_size))
+                    if not window:
+                        break
+                    
+                    texts = [content[start:end].strip() for _, start, end in window]
                     
-                    # Generate embeddings for batch
-                    embeddings = self.embeddings_service.get_embeddings(batch_texts)
+                    # Generate embeddings (cached by chunk hash, misses batched concurrently)
+                    embeddings = self._get_chunk_embeddings(db, texts)
                     
-                    # Create chunk objects
-                    for j, chunk_data in enumerate(batch_chunks):
+                    # Collect chunk rows
+                    rows = []
+                    for (chunk_index, start, end), chunk, embedding in zip(window, texts, embeddings):
                         chunk_metadata = {
                             **(metadata or {}),
-                            **chunk_data.get('metadata', {}),
-                            'chunk_index': chunk_data.get('index', i + j)
+                            'start_char': start,
+                            'end_char': end,
+                            'chunk_size': len(chunk),
+                            'chunk_index': chunk_index
                         }
                         
-                        chunk = Chunk(
-                            doc_id=document.id,
-                            text=chunk_data['text'],
-                            embedding=embeddings[j],
-                            chunk_metadata=chunk_metadata
-                        )
-                        db.add(chunk)
+                        rows.append((
+                            document_id,
+                            chunk,
+                            embedding,
+                            chunk_metadata
+                        ))
+                    
+                    self._insert_chunks(db, rows)
+                    chunk_count += len(window)
+                
+                logger.info(f"Split document into {chunk_count} chunks")
                 
                 db.commit()
-                logger.info(f"Successfully indexed document {document.id} with {len(chunks)} chunks")
-                return document.id
+                self.query_cache.clear()
+                logger.info(f"Successfully indexed document {document_id} with {chunk_count} chunks")
+                return document_id
                 
-            except IntegrityError as e:
-                db.rollback()
-                logger.error(f"Document already exists: {e}")
-                raise
             except Exception as e:
                 db.rollback()
                 logger.error(f"Error indexing document: {e}")
@@ -155,7 +500,8 @@ class DatabaseService:
         self,
         query: str,
         limit: int = 10,
-        similarity_threshold: Optional[float] = None
+        similarity_threshold: Optional[float] = None,
+        ef_search: Optional[int] = None
     ) -> List[Dict]:
         """
         Perform semantic search using vector similarity
@@ -163,7 +509,9 @@ class DatabaseService:
         Args:
             query: Search query text
             limit: Maximum number of results
-            similarity_threshold: Optional similarity threshold
+            similarity_threshold: Optional minimum cosine similarity
+            ef_search: HNSW candidate list size for this query (defaults to the
+                service setting); higher trades latency for recall
         
         Returns:
             List of search results with metadata
@@ -172,37 +520,135 @@ class DatabaseService:
             # Generate embedding for query
             query_embedding = self.embeddings_service.get_embedding(query)
             
-            # Convert embedding to string format for pgvector
-            embedding_str = f"[{','.join(map(str, query_embedding))}]"
+            search_results = self.search_by_embedding(
+                query_embedding,
+                limit=limit,
+                similarity_threshold=similarity_threshold,
+                ef_search=ef_search
+            )
+            
+            logger.info(f"Found {len(search_results)} results for query: '{query[:50]}...'")
+            return search_results
+            
+        except Exception as e:
+            logger.error(f"Error performing search: {e}")
+            raise
+    
+    def search_by_embedding(
+        self,
+        query_embedding: List[float],
+        limit: int = 10,
+        similarity_threshold: Optional[float] = None,
+        ef_search: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Perform semantic search with a precomputed query embedding
+        
+        Args:
+            query_embedding: Query embedding from the same model as the chunks
+            limit: Maximum number of results
+            similarity_threshold: Optional minimum cosine similarity
+            ef_search: HNSW candidate list size for this query (defaults to the
+                service setting); higher trades latency for recall
+        
+        Returns:
+            List of search results with metadata
+        """
+        try:
+            # Serve near-duplicate queries from the semantic cache
+            ef_search = ef_search or self.ef_search
+            cache_params = (limit, similarity_threshold, ef_search)
+            cached_results = self.query_cache.get(query_embedding, cache_params)
+            if cached_results is not None:
+                logger.info("Semantic cache hit")
+                return cached_results
+            
+            # The HNSW scan returns at most ef_search rows, so it must cover
+            # the prefilter candidate count. The threshold is applied to those
+            # rows, after the scan, so leave headroom for the rejected ones
+            ef_search = max(ef_search, self.prefilter_candidates or 0)
+            if similarity_threshold is not None:
+                ef_search = min(
+                    max(ef_search, limit * THRESHOLD_EF_SEARCH_FACTOR), HNSW_EF_SEARCH_MAX
+                )
             
-            with self.SessionLocal() as db:
-                # Build search query with vector similarity using formatted string
-                sql_query = f"""
+            # Plain pooled connection, the ORM session adds nothing for a read
+            with self.engine.connect() as conn:
+                # Scope the HNSW candidate list size and a statement timeout
+                # to this transaction
+                conn.execute(
+                    text(
+                        "SELECT set_config('hnsw.ef_search', :ef, true), "
+                        "set_config('statement_timeout', :timeout, true)"
+                    ),
+                    {"ef": str(ef_search), "timeout": str(self.search_timeout_ms)}
+                )
+                
+                candidates_cte = ""
+                source_table = "chunks"
+                if self.prefilter_candidates:
+                    # Coarse Hamming-distance pass over the bit index; the
+                    # exact halfvec distance below only reranks these rows
+                    candidates_cte = """
+                    candidates AS (
+                        SELECT id, doc_id, text, chunk_metadata, embedding
+                        FROM chunks
+                        ORDER BY binary_quantize(embedding)::bit(768)
+                            <~> binary_quantize(CAST(:q AS halfvec))
+                        LIMIT :candidates
+                    ),"""
+                    source_table = "candidates"
+                
+                # Filter by distance in SQL so rejected rows never leave the server
+                threshold_clause = (
+                    "WHERE (embedding <=> CAST(:q AS halfvec)) <= 1 - :thresh"
+                    if similarity_threshold is not None else ""
+                )
+                
+                # Build search query; the embedding is bound once as an fp16 text
+                # literal (what halfvec stores anyway) and cast server-side.
+                # The ANN cut runs on chunks alone, documents are joined for
+                # the top-K rows only
+                sql_query = text(f"""
+                    WITH {candidates_cte}
+                    top AS (
+                        SELECT
+                            id,
+                            doc_id,
+                            text,
+                            chunk_metadata,
+                            (embedding <=> CAST(:q AS halfvec)) as distance
+                        FROM {source_table}
+                        {threshold_clause}
+                        ORDER BY embedding <=> CAST(:q AS halfvec)
+                        LIMIT :lim
+                    )
                     SELECT 
-                        c.id,
-                        c.text,
-                        c.chunk_metadata,
+                        t.id,
+                        t.text,
+                        t.chunk_metadata,
                         d.source,
                         d.uri,
                         d.title,
                         d.mime,
-                        (c.embedding <-> '{embedding_str}'::vector) as distance
-                    FROM chunks c
-                    JOIN documents d ON c.doc_id = d.id
-                    ORDER BY c.embedding <-> '{embedding_str}'::vector
-                    LIMIT {limit}
-                """
+                        t.distance
+                    FROM top t
+                    JOIN documents d ON d.id = t.doc_id
+                    ORDER BY t.distance
+                """).bindparams(bindparam("lim", type_=Integer()))
+                
+                params = {"q": _to_halfvec_text(query_embedding), "lim": limit}
+                if similarity_threshold is not None:
+                    params["thresh"] = similarity_threshold
+                if self.prefilter_candidates:
+                    params["candidates"] = self.prefilter_candidates
                 
                 # Execute search
-                results = db.execute(text(sql_query)).fetchall()
+                results = conn.execute(sql_query, params).fetchall()
                 
                 # Format results
                 search_results = []
                 for row in results:
-                    # Skip results above similarity threshold if specified
-                    if similarity_threshold and row.distance > similarity_threshold:
-                        continue
-                    
                     result = {
                         "chunk_id": row.id,
                         "text": row.text,
@@ -213,12 +659,12 @@ class DatabaseService:
                             "title": row.title,
                             "mime": row.mime
                         },
-                        "similarity_score": 1.0 - row.distance,  # Convert distance to similarity
+                        "similarity_score": 1.0 - row.distance,  # Cosine distance to cosine similarity
                         "distance": row.distance
                     }
                     search_results.append(result)
                 
-                logger.info(f"Found {len(search_results)} results for query: '{query[:50]}...'")
+                self.query_cache.put(query_embedding, cache_params, search_results)
                 return search_results
                 
         except Exception as e:
@@ -233,7 +679,8 @@ class DatabaseService:
             
             return {
                 "documents": doc_count,
-                "chunks": chunk_count
+                "chunks": chunk_count,
+                "search_cache": self.query_cache.stats()
             }
     
     def delete_document(self, document_id: int) -> bool:
@@ -253,13 +700,104 @@ class DatabaseService:
             
             db.delete(document)  # Cascading delete will remove chunks
             db.commit()
+            self.query_cache.clear()
             logger.info(f"Deleted document {document_id}")
             return True
 
 
+def database_url_from_env() -> str:
+    """Build the PostgreSQL connection URL from environment variables"""
+    # Priorité à DATABASE_URL pour connexion locale
+    database_url = os.getenv("DATABASE_URL")
+    
+    if not database_url:
+        # Build database URL from environment variables
+        sql_instance = os.getenv("SQL_INSTANCE")
+        sql_db = os.getenv("SQL_DB", "kcdb")
+        sql_user = os.getenv("SQL_USER", "postgres")
+        sql_password = os.getenv("SQL_PASSWORD")
+        
+        if sql_instance and sql_password:
+            # Cloud SQL format
+            database_url = f"postgresql://{sql_user}:{sql_password}@/{sql_db}?host=/cloudsql/{sql_instance}"
+        else:
+            # Local PostgreSQL
+            host = os.getenv("DB_HOST", "localhost")
+            port = os.getenv("DB_PORT", "5432")
+            database_url = f"postgresql://{sql_user}:{sql_password}@{host}:{port}/{sql_db}"
+    
+    return database_url
+
+
+def migrate_database(
+    database_url: Optional[str] = None,
+    prefilter_candidates: Optional[int] = None
+):
+    """
+    Apply schema migrations and (re)build the vector indexes
+    
+    Run once per deployment (python main.py migrate, or python app.py migrate
+    in the MCP server image), not from app startup:
+    it can rewrite tables and build HNSW indexes over the whole corpus. Holds
+    the same advisory lock as DatabaseService startup, so workers wait for it.
+    
+    Args:
+        database_url: PostgreSQL connection URL (defaults to the environment)
+        prefilter_candidates: Build the binary prefilter index if set
+            (defaults to BINARY_PREFILTER_CANDIDATES env var)
+    """
+    database_url = database_url or database_url_from_env()
+    if prefilter_candidates is None and os.getenv("BINARY_PREFILTER_CANDIDATES"):
+        prefilter_candidates = int(os.getenv("BINARY_PREFILTER_CANDIDATES"))
+    
+    engine = create_engine(
+        database_url,
+        poolclass=NullPool,
+        connect_args={"application_name": "docpilot-migrate"}
+    )
+    try:
+        with _schema_lock(engine) as conn:
+            _create_schema(conn)
+            
+            # Tables created before the switch to fp16 storage still hold
+            # vector(768); the old chunks index must go first since its
+            # opclass does not apply to halfvec
+            for table in _legacy_embedding_tables(conn):
+                logger.info(f"Migrating {table}.embedding to halfvec(768)")
+                if table == "chunks":
+                    conn.execute(text("DROP INDEX IF EXISTS chunks_embedding_hnsw_idx;"))
+                conn.execute(text(
+                    f"ALTER TABLE {table} ALTER COLUMN embedding "
+                    "TYPE halfvec(768) USING embedding::halfvec(768);"
+                ))
+            
+            # create_all only builds indexes with new tables
+            conn.execute(text(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS chunks_doc_id_idx ON chunks (doc_id);"
+            ))
+            
+            if prefilter_candidates and prefilter_candidates > 0:
+                # Expression index on sign bits: 32x smaller than the halfvec
+                # index, no extra column to populate at ingest
+                conn.execute(text(
+                    "CREATE INDEX CONCURRENTLY IF NOT EXISTS chunks_embedding_bits_hnsw_idx "
+                    "ON chunks USING hnsw "
+                    "((binary_quantize(embedding)::bit(768)) bit_hamming_ops);"
+                ))
+            
+            chunk_count = conn.execute(text("SELECT count(*) FROM chunks;")).scalar()
+            _configure_hnsw_index(conn, chunk_count)
+        
+        logger.info("Database migrated")
+    finally:
+        engine.dispose()
+
+
 def create_database_service(
     database_url: Optional[str] = None,
-    embeddings_service: Optional[VertexAIEmbeddings] = None
+    embeddings_service: Optional[VertexAIEmbeddings] = None,
+    ef_search: Optional[int] = None,
+    prefilter_candidates: Optional[int] = None
 ) -> DatabaseService:
     """
     Factory function to create database service with environment variables
@@ -267,31 +805,43 @@ def create_database_service(
     Args:
         database_url: PostgreSQL connection URL
         embeddings_service: Optional embeddings service instance
+        ef_search: HNSW ef_search (defaults to HNSW_EF_SEARCH env var, then to
+            the value picked for the corpus size)
+        prefilter_candidates: Binary-quantized prefilter size (defaults to
+            BINARY_PREFILTER_CANDIDATES env var, disabled if unset)
     
     Returns:
         Configured DatabaseService instance
     """
-    if not database_url:
-        # Priorité à DATABASE_URL pour connexion locale
-        database_url = os.getenv("DATABASE_URL")
-        
-        if not database_url:
-            # Build database URL from environment variables
-            sql_instance = os.getenv("SQL_INSTANCE")
-            sql_db = os.getenv("SQL_DB", "kcdb")
-            sql_user = os.getenv("SQL_USER", "postgres")
-            sql_password = os.getenv("SQL_PASSWORD")
-            
-            if sql_instance and sql_password:
-                # Cloud SQL format
-                database_url = f"postgresql://{sql_user}:{sql_password}@/{sql_db}?host=/cloudsql/{sql_instance}"
-            else:
-                # Local PostgreSQL
-                host = os.getenv("DB_HOST", "localhost")
-                port = os.getenv("DB_PORT", "5432")
-                database_url = f"postgresql://{sql_user}:{sql_password}@{host}:{port}/{sql_db}"
+    database_url = database_url or database_url_from_env()
+    
+    # Both feed hnsw.ef_search, which pgvector only accepts in 1..1000
+    if ef_search is None and os.getenv("HNSW_EF_SEARCH"):
+        ef_search = min(max(int(os.getenv("HNSW_EF_SEARCH")), 1), HNSW_EF_SEARCH_MAX)
+    
+    if prefilter_candidates is None and os.getenv("BINARY_PREFILTER_CANDIDATES"):
+        candidates = min(int(os.getenv("BINARY_PREFILTER_CANDIDATES")), HNSW_EF_SEARCH_MAX)
+        prefilter_candidates = candidates if candidates > 0 else None  # 0 disables it
+    
+    # Workers each hold a pool; split one budget of 20 + 20 connections
+    # between them so the total stays under Postgres' max_connections
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    pool_size = max(2, 20 // workers)
+    max_overflow = max(2, 20 // workers)
+    
+    # Semantic search cache, sized per deployment (capacity 0 disables it)
+    query_cache = SemanticQueryCache(
+        capacity=int(os.getenv("SEARCH_CACHE_SIZE", "512")),
+        threshold=float(os.getenv("SEARCH_CACHE_THRESHOLD", "0.97")),
+        ttl_seconds=float(os.getenv("SEARCH_CACHE_TTL", "300"))
+    )
     
     return DatabaseService(
         database_url=database_url,
-        embeddings_service=embeddings_service
+        embeddings_service=embeddings_service,
+        ef_search=ef_search,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        prefilter_candidates=prefilter_candidates,
+        query_cache=query_cache
     )
\ No newline at end of file
@@ -1,5 +1,6 @@
 from __future__ import annotations
 import math
+import re
 from typing import List, Dict
 
 def approx_token_count(text: str) -> int:
@@ -10,17 +11,20 @@ def approx_token_count(text: str) -> int:
 Text chunking utilities for document processing
 """
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 
+# Same whitespace definition as str.strip()
+_NON_WHITESPACE = re.compile(r"\S")
 
-def chunk_text(
+
+def iter_chunks(
     text: str,
     chunk_size: int = 1000,
     chunk_overlap: int = 200,
     separators: Optional[List[str]] = None
-) -> List[Dict[str, Any]]:
+) -> Iterator[Tuple[int, int, int]]:
     """
-    Split text into chunks with overlap
+    Lazily compute chunk boundaries without copying the text
     
     Args:
         text: Input text to chunk
@@ -28,8 +32,8 @@ def chunk_text(
         chunk_overlap: Number of characters to overlap between chunks
         separators: List of separators to use for splitting (defaults to paragraphs, sentences)
     
-    Returns:
-        List of chunk dictionaries with text, metadata, and index
+    Yields:
+        (index, start, end) tuples; the chunk text is text[start:end].strip()
     """
     if separators is None:
         separators = [
@@ -44,48 +48,85 @@ def chunk_text(
             ""       # Character level
         ]
     
-    chunks = []
+    # Precompile (separator, length, lookback window) once; separators after
+    # the character-level "" sentinel are never reached
+    compiled_separators = []
+    for separator in separators:
+        if separator == "":
+            break
+        compiled_separators.append((separator, len(separator), len(separator) * 10))
+    
+    # Minimum advance per chunk; keeps chunk count ~len(text) / step even
+    # when a separator lands close to start
+    step = max(1, chunk_size - chunk_overlap)
+    
     start = 0
     chunk_index = 0
+    text_length = len(text)
     
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
+    while start < text_length:
+        end = min(start + chunk_size, text_length)
         
         # Try to find a good break point
-        if end < len(text):
+        if end < text_length:
             best_end = end
-            for separator in separators:
-                if separator == "":
-                    break
-                
-                # Look for separator near the end
-                search_start = max(start, end - len(separator) * 10)
+            for separator, separator_length, lookback in compiled_separators:
+                # Look for separator near the end (bounded window, not the whole chunk)
+                search_start = max(start, end - lookback)
                 last_sep = text.rfind(separator, search_start, end)
                 
                 if last_sep > start:
-                    best_end = last_sep + len(separator)
+                    best_end = last_sep + separator_length
                     break
             
             end = best_end
         
-        # Extract chunk text
-        chunk_text = text[start:end].strip()
-        
-        if chunk_text:  # Only add non-empty chunks
-            chunk_data = {
-                "text": chunk_text,
-                "index": chunk_index,
-                "metadata": {
-                    "start_char": start,
-                    "end_char": end,
-                    "chunk_size": len(chunk_text)
-                }
-            }
-            chunks.append(chunk_data)
+        # Only yield non-empty chunks (checked in place, no slice)
+        if _NON_WHITESPACE.search(text, start, end):
+            yield chunk_index, start, end
             chunk_index += 1
         
-        # Move start position with overlap
-        start = max(start + 1, end - chunk_overlap)
+        # The chunk reached the end of the text, anything after would only
+        # repeat its tail
+        if end >= text_length:
+            break
+        
+        # Move start position with overlap, by at least step but never past
+        # end so no text is skipped
+        start = min(max(start + step, end - chunk_overlap), end)
+
+
+def chunk_text(
+    text: str,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+    separators: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Split text into chunks with overlap
+    
+    Args:
+        text: Input text to chunk
+        chunk_size: Maximum size of each chunk in characters
+        chunk_overlap: Number of characters to overlap between chunks
+        separators: List of separators to use for splitting (defaults to paragraphs, sentences)
+    
+    Returns:
+        List of chunk dictionaries with text, metadata, and index
+    """
+    chunks = []
+    
+    for chunk_index, start, end in iter_chunks(text, chunk_size, chunk_overlap, separators):
+        chunk_text = text[start:end].strip()
+        chunks.append({
+            "text": chunk_text,
+            "index": chunk_index,
+            "metadata": {
+                "start_char": start,
+                "end_char": end,
+                "chunk_size": len(chunk_text)
+            }
+        })
     
     return chunks
 
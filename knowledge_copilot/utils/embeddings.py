@@ -2,13 +2,83 @@
 Embeddings service using Vertex AI text-embedding-004 model
 """
 
+import asyncio
 import os
-from typing import List, Optional
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
 from google.oauth2 import service_account
 import vertexai
 from vertexai.language_models import TextEmbeddingModel
 from loguru import logger
 
+from .chunking import approx_token_count
+
+# Vertex AI text-embedding limits per request: 250 inputs, 20k tokens.
+# approx_token_count undercounts non-English text, so keep a margin
+MAX_BATCH_TEXTS = 250
+MAX_BATCH_TOKENS = 15000
+
+# Number of single-text embeddings kept in memory by get_embedding
+EMBEDDING_CACHE_SIZE = 4096
+
+
+class AsyncBatcher:
+    """
+    Coalesces concurrent single-item calls into batched calls
+    
+    Callers submit an item and wait on the returned future; a background
+    thread drains up to max_batch items (waiting at most max_wait seconds
+    after the first one) and resolves them with one batch_fn call.
+    """
+    
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_batch: int = 32,
+        max_wait: float = 0.005
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+    
+    def submit(self, item: Any) -> Future:
+        """Queue an item and return a future for its result"""
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+    
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            
+            while len(pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                results = self.batch_fn([item for item, _ in pending])
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            
+            for (_, future), result in zip(pending, results):
+                future.set_result(result)
+
 
 class VertexAIEmbeddings:
     """Vertex AI embeddings service using text-embedding-004 model"""
@@ -18,7 +88,8 @@ class VertexAIEmbeddings:
         project_id: str,
         region: str = "europe-west1",
         model_name: str = "text-embedding-004",
-        credentials_path: Optional[str] = None
+        credentials_path: Optional[str] = None,
+        cache_size: int = EMBEDDING_CACHE_SIZE
     ):
         self.project_id = project_id
         self.region = region
@@ -31,6 +102,15 @@ class VertexAIEmbeddings:
         # Load the embedding model
         self.model = TextEmbeddingModel.from_pretrained(self.model_name)
         logger.info(f"Initialized Vertex AI embeddings with model: {self.model_name}")
+        
+        # Micro-batcher for single-text calls, started on first use
+        self._batcher: Optional[AsyncBatcher] = None
+        self._batcher_lock = threading.Lock()
+        
+        # LRU of text -> embedding for get_embedding (repeated queries)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._cache_lock = threading.Lock()
     
     def _initialize_vertex_ai(self):
         """Initialize Vertex AI with credentials"""
@@ -73,18 +153,120 @@ class VertexAIEmbeddings:
             logger.error(f"Error generating embeddings: {e}")
             raise
     
+    async def get_embeddings_async(self, texts: List[str]) -> List[List[float]]:
+        """
+        Get embeddings for a list of texts without blocking the event loop
+        
+        Args:
+            texts: List of text strings to embed
+            
+        Returns:
+            List of embedding vectors (list of floats)
+        """
+        return await asyncio.to_thread(self.get_embeddings, texts)
+    
+    def _get_embeddings_with_retry(self, texts: List[str], max_retries: int = 3) -> List[List[float]]:
+        """Get embeddings for one batch, retrying with jittered backoff"""
+        for attempt in range(max_retries):
+            try:
+                return self.get_embeddings(texts)
+            except Exception:
+                if attempt == max_retries - 1:
+                    raise
+                # Jitter keeps concurrent batches from retrying in lockstep (429 spikes)
+                delay = 0.5 * (2 ** attempt) + random.uniform(0, 0.25)
+                logger.warning(f"Embedding batch failed, retrying in {delay:.2f}s")
+                time.sleep(delay)
+    
+    def get_embeddings_batched(
+        self,
+        texts: List[str],
+        batch_size: int = MAX_BATCH_TEXTS,
+        max_inflight: int = 8,
+        max_batch_tokens: int = MAX_BATCH_TOKENS
+    ) -> List[List[float]]:
+        """
+        Get embeddings for many texts, sending batches concurrently
+        
+        Batches are packed as full as the model's per-request limits allow,
+        so a large document costs a handful of requests rather than one per
+        few chunks.
+        
+        Args:
+            texts: List of text strings to embed (batched by length internally)
+            batch_size: Maximum number of texts per model request
+            max_inflight: Maximum number of concurrent model requests
+            max_batch_tokens: Approximate token budget per model request
+            
+        Returns:
+            List of embedding vectors, in the same order as texts
+        """
+        if not texts:
+            return []
+        
+        # Batch similarly sized texts together so no batch is dominated by
+        # one long input (server-side padding)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        
+        batches = []
+        current: List[str] = []
+        current_tokens = 0
+        for i in order:
+            tokens = approx_token_count(texts[i])
+            if current and (len(current) >= batch_size or current_tokens + tokens > max_batch_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(texts[i])
+            current_tokens += tokens
+        batches.append(current)
+        
+        # pool.map preserves batch order
+        with ThreadPoolExecutor(max_workers=min(max_inflight, len(batches))) as pool:
+            batch_results = list(pool.map(self._get_embeddings_with_retry, batches))
+        
+        # Scatter results back to the caller's order
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        sorted_embeddings = (embedding for batch in batch_results for embedding in batch)
+        for i, embedding in zip(order, sorted_embeddings):
+            embeddings[i] = embedding
+        
+        return embeddings
+    
     def get_embedding(self, text: str) -> List[float]:
         """
         Get embedding for a single text
         
+        Recently embedded texts are served from an in-memory LRU cache;
+        concurrent misses (e.g. parallel searches) are coalesced into a
+        single get_embeddings request by a micro-batcher.
+        
         Args:
             text: Text string to embed
             
         Returns:
             Embedding vector as list of floats
         """
-        embeddings = self.get_embeddings([text])
-        return embeddings[0]
+        with self._cache_lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                return list(cached)
+        
+        if self._batcher is None:
+            with self._batcher_lock:
+                if self._batcher is None:
+                    self._batcher = AsyncBatcher(self.get_embeddings)
+        
+        embedding = self._batcher.submit(text).result()
+        
+        if self.cache_size > 0:
+            with self._cache_lock:
+                self._cache[text] = tuple(embedding)
+                self._cache.move_to_end(text)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        
+        return embedding
     
     def get_embedding_dimension(self) -> int:
         """
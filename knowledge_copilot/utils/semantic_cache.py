@@ -0,0 +1,155 @@
+"""
+In-memory semantic cache for search results keyed by query embedding
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+
+class SemanticQueryCache:
+    """
+    LRU cache returning stored results for queries whose embedding is close
+    (cosine similarity >= threshold) to a previously served query
+
+    Embeddings are L2-normalized once on insert and stored in a single
+    preallocated (capacity, dim) float32 matrix, so a lookup is one
+    matrix-vector product.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 512,
+        threshold: float = 0.97,
+        ttl_seconds: float = 300.0
+    ):
+        """
+        Initialize the cache
+
+        Args:
+            capacity: Maximum number of cached queries
+            threshold: Minimum cosine similarity for a hit
+            ttl_seconds: Time-to-live of a cached entry
+        """
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        # Allocated on first put, once the embedding dimension is known
+        self._matrix: Optional[np.ndarray] = None
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._expires_at = np.zeros(capacity, dtype=np.float64)
+        self._high_water = 0  # slots [0, high_water) have been used at least once
+        self._free_slots: List[int] = []
+        # slot -> (params, results), in LRU order
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _release(self, slot: int):
+        del self._entries[slot]
+        self._valid[slot] = False
+        self._free_slots.append(slot)
+
+    def _purge_expired(self, now: float):
+        n = self._high_water
+        for slot in np.flatnonzero(self._valid[:n] & (self._expires_at[:n] <= now)):
+            self._release(int(slot))
+
+    def get(self, embedding: List[float], params: Hashable) -> Optional[List[Dict[str, Any]]]:
+        """
+        Look up results for a query embedding
+
+        Args:
+            embedding: Query embedding
+            params: Search parameters that must match exactly (e.g. limit, threshold)
+
+        Returns:
+            Copy of the cached results, or None on a miss
+        """
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            n = self._high_water
+            sims = self._matrix[:n] @ self._normalize(embedding)
+            sims[~self._valid[:n]] = -np.inf
+
+            candidates = np.flatnonzero(sims >= self.threshold)
+            # Only entries served with the same parameters are candidates
+            for slot in candidates[np.argsort(sims[candidates])[::-1]]:
+                slot = int(slot)
+                entry = self._entries[slot]
+                if entry[0] == params:
+                    self._entries.move_to_end(slot)
+                    self.hits += 1
+                    return [dict(result) for result in entry[1]]
+
+            self.misses += 1
+            return None
+
+    def put(self, embedding: List[float], params: Hashable, results: List[Dict[str, Any]]):
+        """
+        Store results for a query embedding
+
+        Args:
+            embedding: Query embedding
+            params: Search parameters the results were produced with
+            results: Search results
+        """
+        if self.capacity <= 0:
+            return
+
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+
+            if self._free_slots:
+                slot = self._free_slots.pop()
+            elif self._high_water < self.capacity:
+                slot = self._high_water
+                self._high_water += 1
+            else:
+                # Evict the least recently used entry and reuse its slot
+                lru_slot = next(iter(self._entries))
+                self._release(lru_slot)
+                slot = self._free_slots.pop()
+
+            self._matrix[slot] = vector
+            self._valid[slot] = True
+            self._expires_at[slot] = time.monotonic() + self.ttl_seconds
+            self._entries[slot] = (params, [dict(result) for result in results])
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cache size and hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._entries.clear()
+            self._valid[:] = False
+            self._free_slots = list(range(self._high_water))
@@ -3,13 +3,19 @@ DocPilot - RAG System with Vertex AI Embeddings and pgvector
 Jour 3: Embeddings & Index implementation
 """
 
+import asyncio
+import codecs
 import os
 import sys
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, TypedDict
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+import msgpack
+import orjson
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from loguru import logger
 from dotenv import load_dotenv
 
@@ -21,10 +27,14 @@ sys.path.append(str(Path(__file__).parent))
 
 # Import RAG service
 from knowledge_copilot.rag_service import create_rag_service
+from knowledge_copilot.services import migrate_database
 
 # Global variable for RAG service
 rag_service = None
 
+# Bytes read per step when streaming an upload
+UPLOAD_READ_BLOCK = 1024 * 1024
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize and cleanup RAG service"""
@@ -44,6 +54,13 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down DocPilot RAG service")
 
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson (numpy arrays serialized natively)"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
 # Initialize FastAPI app with lifespan
 app = FastAPI(
     title="DocPilot RAG API",
@@ -52,6 +69,10 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Search results (chunk text + repeated metadata) compress well; small
+# responses are left alone since gzip would not pay for itself
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 
 # Pydantic models for API requests/responses
 class DocumentIndexRequest(BaseModel):
@@ -68,6 +89,26 @@ class SearchRequest(BaseModel):
     limit: int = 10
     similarity_threshold: Optional[float] = None
     source_filter: Optional[str] = None
+    # pgvector accepts hnsw.ef_search in 1..1000
+    ef_search: Optional[int] = Field(default=None, ge=1, le=1000)
+
+
+class VectorSearchRequest(BaseModel):
+    embedding: List[float]
+    query: Optional[str] = None
+    limit: int = 10
+    similarity_threshold: Optional[float] = None
+    source_filter: Optional[str] = None
+    # pgvector accepts hnsw.ef_search in 1..1000
+    ef_search: Optional[int] = Field(default=None, ge=1, le=1000)
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+
+
+# Validates a decoded /batch-index-binary payload in one pydantic-core pass
+DOCUMENT_BATCH_ADAPTER = TypeAdapter(List[DocumentIndexRequest])
 
 
 class DocumentIndexResponse(BaseModel):
@@ -76,7 +117,9 @@ class DocumentIndexResponse(BaseModel):
     message: str
 
 
-class SearchResponse(BaseModel):
+# TypedDict rather than a model: search responses are built on every query
+# and FastAPI validates and serializes them in pydantic-core either way
+class SearchResponse(TypedDict):
     query: str
     results: List[Dict[str, Any]]
     total_results: int
@@ -95,6 +138,10 @@ async def root():
         "endpoints": {
             "index_document": "/index",
             "search": "/search", 
+            "search_by_vector": "/search-by-vector",
+            "embed": "/embed",
+            "batch_index": "/batch-index",
+            "batch_index_binary": "/batch-index-binary",
             "stats": "/stats",
             "health": "/health"
         }
@@ -108,7 +155,7 @@ async def health_check():
         if rag_service is None:
             raise HTTPException(status_code=503, detail="RAG service not initialized")
         
-        stats = rag_service.get_stats()
+        stats = await asyncio.to_thread(rag_service.get_stats)
         return {
             "status": "healthy",
             "service": "active",
@@ -136,7 +183,9 @@ async def index_document(request: DocumentIndexRequest):
         
         logger.info(f"Indexing document: {request.title or 'Untitled'}")
         
-        document_id = rag_service.index_document(
+        # Blocking DB/embedding work runs in a worker thread so the event
+        # loop keeps serving other requests
+        document_id = await rag_service.index_document_async(
             content=request.content,
             title=request.title,
             source=request.source,
@@ -173,11 +222,13 @@ async def search_documents(request: SearchRequest):
         
         logger.info(f"Searching for: '{request.query}'")
         
-        results = rag_service.search(
+        results = await asyncio.to_thread(
+            rag_service.search,
             query=request.query,
             limit=request.limit,
             similarity_threshold=request.similarity_threshold,
-            source_filter=request.source_filter
+            source_filter=request.source_filter,
+            ef_search=request.ef_search
         )
         
         return SearchResponse(
@@ -187,7 +238,8 @@ async def search_documents(request: SearchRequest):
             search_metadata={
                 "limit": request.limit,
                 "similarity_threshold": request.similarity_threshold,
-                "source_filter": request.source_filter
+                "source_filter": request.source_filter,
+                "ef_search": request.ef_search
             }
         )
         
@@ -196,6 +248,84 @@ async def search_documents(request: SearchRequest):
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 
+@app.post("/search-by-vector", response_model=SearchResponse)
+async def search_by_vector(request: VectorSearchRequest):
+    """
+    Perform semantic search with a precomputed query embedding
+    
+    Lets clients that already hold a query embedding (e.g. from /embed)
+    skip server-side embedding.
+    
+    Args:
+        request: Search request with query embedding and parameters
+        
+    Returns:
+        Search results with similarity scores
+    """
+    try:
+        if rag_service is None:
+            raise HTTPException(status_code=503, detail="RAG service not initialized")
+        
+        dimension = rag_service.embeddings_service.get_embedding_dimension()
+        if len(request.embedding) != dimension:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Embedding must have {dimension} dimensions, got {len(request.embedding)}"
+            )
+        
+        results = await asyncio.to_thread(
+            rag_service.search_by_vector,
+            embedding=request.embedding,
+            query=request.query,
+            limit=request.limit,
+            similarity_threshold=request.similarity_threshold,
+            source_filter=request.source_filter,
+            ef_search=request.ef_search
+        )
+        
+        return SearchResponse(
+            query=request.query or "",
+            results=results,
+            total_results=len(results),
+            search_metadata={
+                "limit": request.limit,
+                "similarity_threshold": request.similarity_threshold,
+                "source_filter": request.source_filter,
+                "ef_search": request.ef_search
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error performing vector search: {e}")
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+
+@app.post("/embed", response_class=ORJSONResponse)
+async def embed_texts(request: EmbedRequest):
+    """Embed texts with the indexing model (one batched model call)"""
+    try:
+        if rag_service is None:
+            raise HTTPException(status_code=503, detail="RAG service not initialized")
+        
+        embeddings = await asyncio.to_thread(rag_service.embed_texts, request.texts)
+        
+        # Returned as a response object so FastAPI skips jsonable_encoder,
+        # which walks every float in Python
+        return ORJSONResponse({
+            "embeddings": embeddings,
+            "model": rag_service.embeddings_service.model_name,
+            "dimension": rag_service.embeddings_service.get_embedding_dimension()
+        })
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error embedding texts: {e}")
+        raise HTTPException(status_code=500, detail=f"Embedding failed: {str(e)}")
+
+
 @app.get("/stats")
 async def get_stats():
     """Get system statistics"""
@@ -203,7 +333,7 @@ async def get_stats():
         if rag_service is None:
             raise HTTPException(status_code=503, detail="RAG service not initialized")
         
-        stats = rag_service.get_stats()
+        stats = await asyncio.to_thread(rag_service.get_stats)
         return stats
         
     except Exception as e:
@@ -218,7 +348,7 @@ async def delete_document(document_id: int):
         if rag_service is None:
             raise HTTPException(status_code=503, detail="RAG service not initialized")
         
-        success = rag_service.delete_document(document_id)
+        success = await asyncio.to_thread(rag_service.delete_document, document_id)
         
         if success:
             return {"message": f"Document {document_id} deleted successfully"}
@@ -239,17 +369,24 @@ async def upload_file(file: UploadFile = File(...)):
         if rag_service is None:
             raise HTTPException(status_code=503, detail="RAG service not initialized")
         
-        # Read file content
-        content = await file.read()
-        
-        # Decode content (assuming text file)
+        # Read and decode the file block by block (assuming text file), so
+        # the raw bytes are never held in memory all at once
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        parts = []
+        size = 0
         try:
-            text_content = content.decode('utf-8')
+            while block := await file.read(UPLOAD_READ_BLOCK):
+                size += len(block)
+                parts.append(decoder.decode(block))
+            parts.append(decoder.decode(b"", final=True))
         except UnicodeDecodeError:
             raise HTTPException(status_code=400, detail="File must be valid UTF-8 text")
         
+        text_content = "".join(parts)
+        del parts
+        
         # Index the document
-        document_id = rag_service.index_document(
+        document_id = await rag_service.index_document_async(
             content=text_content,
             title=file.filename,
             source="upload",
@@ -257,7 +394,7 @@ async def upload_file(file: UploadFile = File(...)):
             mime=file.content_type or "text/plain",
             metadata={
                 "filename": file.filename,
-                "size": len(content),
+                "size": size,
                 "upload_method": "file_upload"
             }
         )
@@ -265,7 +402,7 @@ async def upload_file(file: UploadFile = File(...)):
         return {
             "document_id": document_id,
             "filename": file.filename,
-            "size": len(content),
+            "size": size,
             "status": "indexed"
         }
         
@@ -296,7 +433,7 @@ async def batch_index_documents(documents: List[DocumentIndexRequest]):
             for doc in documents
         ]
         
-        document_ids = rag_service.batch_index_documents(doc_dicts)
+        document_ids = await rag_service.batch_index_documents_async(doc_dicts)
         
         return {
             "total_documents": len(documents),
@@ -310,22 +447,58 @@ async def batch_index_documents(documents: List[DocumentIndexRequest]):
         raise HTTPException(status_code=500, detail=f"Batch indexing failed: {str(e)}")
 
 
+@app.post("/batch-index-binary")
+async def batch_index_documents_binary(request: Request):
+    """
+    Index multiple documents in batch from a msgpack body
+    
+    Same payload shape and response as /batch-index (an array of
+    DocumentIndexRequest), but smaller on the wire and faster to parse.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in ("application/msgpack", "application/x-msgpack"):
+        raise HTTPException(status_code=415, detail="Content-Type must be application/msgpack")
+    
+    try:
+        data = msgpack.unpackb(await request.body(), raw=False)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid msgpack body: {str(e)}")
+    
+    try:
+        documents = DOCUMENT_BATCH_ADAPTER.validate_python(data)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    
+    return await batch_index_documents(documents)
+
+
 def main():
-    """Main function to run the application"""
+    """Main function to run the application (`python main.py migrate` migrates the database)"""
     import uvicorn
     
+    if sys.argv[1:2] == ["migrate"]:
+        migrate_database()
+        return
+    
     # Configuration
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8000"))
     reload = os.getenv("RELOAD", "false").lower() == "true"
+    # Single worker unless WEB_CONCURRENCY asks for more; the per-worker DB
+    # pool shrinks accordingly (see create_database_service)
+    workers = 1 if reload else max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
     
-    logger.info(f"Starting DocPilot RAG API on {host}:{port}")
+    logger.info(f"Starting DocPilot RAG API on {host}:{port} with {workers} worker(s)")
     
     uvicorn.run(
         "main:app",
         host=host,
         port=port,
         reload=reload,
+        workers=workers,
+        # "auto" picks uvloop/httptools when uvicorn[standard] is installed
+        loop="auto",
+        http="auto",
         log_level="info"
     )
 
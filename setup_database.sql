@@ -20,19 +20,32 @@ CREATE TABLE IF NOT EXISTS chunks (
     id SERIAL PRIMARY KEY,
     doc_id INT REFERENCES documents(id) ON DELETE CASCADE,
     text TEXT NOT NULL,
-    embedding VECTOR(768),  -- 768 dimensions for text-embedding-004
+    embedding HALFVEC(768),  -- 768 dimensions for text-embedding-004, fp16 (pgvector >= 0.7)
     chunk_metadata JSONB
 );
 
+-- Cache of chunk embeddings keyed by SHA256 of the chunk text
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    content_hash TEXT PRIMARY KEY,
+    embedding HALFVEC(768) NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT now()
+);
+
 -- Create HNSW index for vector similarity search
 -- HNSW is recommended for pgvector >= 0.5
+-- Parameters suit a new corpus; the API rebuilds the index as the corpus grows
 CREATE INDEX IF NOT EXISTS chunks_embedding_hnsw_idx 
-ON chunks USING hnsw (embedding vector_l2_ops)
+ON chunks USING hnsw (embedding halfvec_cosine_ops)
 WITH (m = 16, ef_construction = 64);
 
 -- Alternative: IVFFlat index (if HNSW not available)
 -- CREATE INDEX chunks_embedding_ivfflat_idx 
--- ON chunks USING ivfflat (embedding vector_l2_ops) WITH (lists = 100);
+-- ON chunks USING ivfflat (embedding halfvec_cosine_ops) WITH (lists = 100);
+
+-- Optional: binary-quantized prefilter index for very large corpora (>1M chunks),
+-- used when BINARY_PREFILTER_CANDIDATES is set
+-- CREATE INDEX chunks_embedding_bits_hnsw_idx
+-- ON chunks USING hnsw ((binary_quantize(embedding)::bit(768)) bit_hamming_ops);
 
 -- Create additional indexes for performance
 CREATE INDEX IF NOT EXISTS documents_content_hash_idx ON documents(content_hash);
@@ -43,5 +56,5 @@ CREATE INDEX IF NOT EXISTS chunks_doc_id_idx ON chunks(doc_id);
 SELECT 'pgvector extension enabled' as status;
 SELECT table_name, column_name, data_type 
 FROM information_schema.columns 
-WHERE table_name IN ('documents', 'chunks') 
+WHERE table_name IN ('documents', 'chunks', 'embedding_cache') 
 ORDER BY table_name, ordinal_position;
\ No newline at end of file
@@ -4,17 +4,100 @@ Jour 5: Agent + CLI/mini-UI & Qualité
 """
 
 import asyncio
+import atexit
+import json
 import os
 import sys
+import threading
+import time
+import zlib
+from collections import deque
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional
 import streamlit as st
 from datetime import datetime
 
 # Add current directory to Python path for imports
 sys.path.append(str(Path(__file__).parent))
 
-from knowledge_copilot.agent import create_agent, SearchFilter
+from knowledge_copilot.agent import create_agent, MCPClient, SearchFilter
+
+
+# Example questions offered in the UI (embedded once, see load_example_embeddings)
+EXAMPLE_QUESTIONS = (
+    "Comment packager un modèle pour Cloud Run ?",
+    "Configuration Docker pour Python",
+    "API endpoints disponibles",
+    "Installation des dépendances",
+    "Déploiement avec CI/CD"
+)
+EXAMPLE_KEYS = tuple(f"example_{i}" for i in range(len(EXAMPLE_QUESTIONS)))
+EXAMPLE_LABELS = tuple(f"💬 {eq[:30]}..." for eq in EXAMPLE_QUESTIONS)
+
+# Sidebar choices
+SOURCE_OPTIONS = ("Toutes", "github", "gdrive")
+MIME_OPTIONS = ("Tous", "text/markdown", "text/plain", "application/pdf", "text/html")
+LLM_PROVIDERS = ("vertex", "openai")
+
+# "All" choices in the sidebar, which mean no filter
+SENTINEL = {"Toutes": None, "Tous": None}
+
+
+# Conversation entries kept per session (oldest dropped first)
+HISTORY_MAX_ENTRIES = 50
+
+# After a failed example prefetch, skip /embed for this long so reruns
+# don't each wait on an unavailable service
+EXAMPLE_EMBEDDINGS_RETRY_SECONDS = 60
+
+
+class ConversationHistory:
+    """
+    Bounded conversation history stored column-wise
+    
+    Sources, by far the largest part of an entry, are kept as compressed
+    JSON and only decoded on demand, which keeps session state small.
+    """
+    
+    def __init__(self, max_entries: int = HISTORY_MAX_ENTRIES):
+        self.questions: deque = deque(maxlen=max_entries)
+        self.answers: deque = deque(maxlen=max_entries)
+        self.response_times: deque = deque(maxlen=max_entries)
+        self.timestamps: deque = deque(maxlen=max_entries)
+        self.trace_ids: deque = deque(maxlen=max_entries)
+        self.source_counts: deque = deque(maxlen=max_entries)
+        self.sources_blobs: deque = deque(maxlen=max_entries)
+    
+    def __len__(self) -> int:
+        return len(self.questions)
+    
+    def append(self, question: str, answer: str, sources: List[Dict[str, Any]],
+               response_time: float, timestamp: str, trace_id: str):
+        """Add an entry, dropping the oldest one when full"""
+        self.questions.append(question)
+        self.answers.append(answer)
+        self.response_times.append(response_time)
+        self.timestamps.append(timestamp)
+        self.trace_ids.append(trace_id)
+        self.source_counts.append(len(sources))
+        self.sources_blobs.append(zlib.compress(json.dumps(sources).encode()))
+    
+    def sources(self, index: int) -> List[Dict[str, Any]]:
+        """Decode the sources of one entry"""
+        return json.loads(zlib.decompress(self.sources_blobs[index]))
+    
+    def recent(self, n: int) -> Iterator[Dict[str, Any]]:
+        """Last n entries, newest first (sources as a count only)"""
+        for i in range(len(self) - 1, max(len(self) - n, 0) - 1, -1):
+            yield {
+                "index": i,
+                "question": self.questions[i],
+                "answer": self.answers[i],
+                "response_time": self.response_times[i],
+                "timestamp": self.timestamps[i],
+                "trace_id": self.trace_ids[i],
+                "source_count": self.source_counts[i]
+            }
 
 
 # Page configuration
@@ -67,10 +150,79 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Event loop shared by all reruns, running in a background thread"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="docpilot-event-loop", daemon=True).start()
+    return loop
+
+
+def run_async(coro):
+    """Run a coroutine on the shared event loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+@st.cache_resource
+def get_agent(mcp_url: str, llm_provider: str, project_id: str, openai_api_key: str):
+    """
+    Agent shared across reruns for a given configuration, so its HTTP
+    connection pool and LLM client are reused between questions
+    """
+    agent = create_agent(
+        mcp_url=mcp_url,
+        llm_provider=llm_provider,
+        project_id=project_id,
+        openai_api_key=openai_api_key
+    )
+    atexit.register(lambda: run_async(agent.close()))
+    return agent
+
+
+@st.cache_data(show_spinner=False)
+def load_example_embeddings(mcp_url: str) -> Dict[str, List[float]]:
+    """
+    Embed the example questions with one /embed call, so clicking an example
+    searches by vector without embedding the question again
+    
+    Failures raise and are therefore not cached; the next rerun retries.
+    """
+    client = MCPClient(mcp_url, timeout=5)
+    try:
+        embeddings = run_async(client.embed_texts(list(EXAMPLE_QUESTIONS)))
+    finally:
+        run_async(client.close())
+    return dict(zip(EXAMPLE_QUESTIONS, embeddings))
+
+
+@st.cache_resource
+def example_embedding_failures() -> Dict[str, float]:
+    """mcp_url -> monotonic time before which the prefetch is not retried"""
+    return {}
+
+
+def get_example_embeddings(mcp_url: str) -> Dict[str, List[float]]:
+    """
+    Example question embeddings, or an empty dict if the service is unavailable
+    
+    A failure is remembered for EXAMPLE_EMBEDDINGS_RETRY_SECONDS across all
+    sessions, during which reruns return immediately without calling /embed.
+    """
+    failures = example_embedding_failures()
+    if time.monotonic() < failures.get(mcp_url, 0.0):
+        return {}
+    
+    try:
+        return load_example_embeddings(mcp_url)
+    except Exception:
+        failures[mcp_url] = time.monotonic() + EXAMPLE_EMBEDDINGS_RETRY_SECONDS
+        return {}
+
+
 def initialize_session_state():
     """Initialize Streamlit session state"""
     if "conversation_history" not in st.session_state:
-        st.session_state.conversation_history = []
+        st.session_state.conversation_history = ConversationHistory()
     if "agent_config" not in st.session_state:
         st.session_state.agent_config = {
             "mcp_url": os.getenv("MCP_URL", "http://localhost:8000"),
@@ -96,7 +248,7 @@ def sidebar_configuration():
     st.sidebar.subheader("Modèle de langage")
     llm_provider = st.sidebar.selectbox(
         "Fournisseur LLM",
-        ["vertex", "openai"],
+        LLM_PROVIDERS,
         index=0 if st.session_state.agent_config["llm_provider"] == "vertex" else 1
     )
     
@@ -130,7 +282,7 @@ def sidebar_configuration():
     
     source_filter = st.sidebar.selectbox(
         "Source",
-        ["Toutes", "github", "gdrive"],
+        SOURCE_OPTIONS,
         help="Filtrer par source de documents"
     )
     
@@ -142,7 +294,7 @@ def sidebar_configuration():
     
     mime_filter = st.sidebar.selectbox(
         "Type de fichier",
-        ["Tous", "text/markdown", "text/plain", "application/pdf", "text/html"],
+        MIME_OPTIONS,
         help="Filtrer par type MIME"
     )
     
@@ -168,9 +320,9 @@ def sidebar_configuration():
     
     # Create filter object
     filters = SearchFilter(
-        source=source_filter if source_filter != "Toutes" else None,
-        repo=repo_filter if repo_filter else None,
-        mime=mime_filter if mime_filter != "Tous" else None,
+        source=SENTINEL.get(source_filter, source_filter),
+        repo=repo_filter or None,
+        mime=SENTINEL.get(mime_filter, mime_filter),
         top_k=top_k,
         similarity_threshold=similarity_threshold
     )
@@ -178,22 +330,20 @@ def sidebar_configuration():
     return filters
 
 
-async def process_question_async(question: str, filters: SearchFilter) -> Dict[str, Any]:
-    """Process question asynchronously"""
+async def process_question_async(
+    agent,
+    question: str,
+    filters: SearchFilter,
+    query_embedding: Optional[List[float]] = None
+) -> Dict[str, Any]:
+    """
+    Process question asynchronously
+    
+    Runs on the shared loop thread, which has no Streamlit script context:
+    the agent is resolved by the caller and nothing here touches st.*.
+    """
     try:
-        # Create agent
-        agent = create_agent(
-            mcp_url=st.session_state.agent_config["mcp_url"],
-            llm_provider=st.session_state.agent_config["llm_provider"],
-            project_id=st.session_state.agent_config["project_id"],
-            openai_api_key=st.session_state.agent_config["openai_api_key"]
-        )
-        
-        # Process question
-        response = await agent.ask(question, filters)
-        
-        # Close agent
-        await agent.close()
+        response = await agent.ask(question, filters, query_embedding=query_embedding)
         
         return {
             "success": True,
@@ -306,26 +456,22 @@ def display_conversation_history():
     if st.session_state.conversation_history:
         st.markdown("### 📜 Historique des conversations")
         
-        for i, entry in enumerate(reversed(st.session_state.conversation_history[-5:])):  # Last 5
+        history = st.session_state.conversation_history
+        for entry in history.recent(5):  # Last 5
             with st.expander(f"💬 {entry['question'][:50]}... ({entry['timestamp']})"):
                 st.markdown(f"**Question:** {entry['question']}")
                 st.markdown(f"**Réponse:** {entry['answer']}")
-                st.markdown(f"**Sources:** {len(entry['sources'])} documents")
+                st.markdown(f"**Sources:** {entry['source_count']} documents")
+                # Decompressed only for the entries being displayed
+                for source in history.sources(entry["index"]):
+                    st.markdown(f"- {source['title']} (`{source['uri']}`, sim: {source['similarity_score']:.3f})")
                 st.markdown(f"**Temps:** {entry['response_time']:.3f}s")
 
 
-async def health_check_async():
-    """Check system health"""
+async def health_check_async(agent):
+    """Check system health (runs on the loop thread, must not touch st.*)"""
     try:
-        agent = create_agent(
-            mcp_url=st.session_state.agent_config["mcp_url"],
-            llm_provider="vertex",  # Use vertex by default for health check
-            project_id=st.session_state.agent_config["project_id"] or os.getenv("PROJECT_ID", "dummy")
-        )
-        
-        health = await agent.health_check()
-        await agent.close()
-        return health
+        return await agent.health_check()
         
     except Exception as e:
         return {"status": "unhealthy", "error": str(e)}
@@ -344,6 +490,9 @@ def main():
     # Sidebar configuration
     filters = sidebar_configuration()
     
+    # Pre-embed the example questions once (cached across reruns)
+    get_example_embeddings(st.session_state.agent_config["mcp_url"])
+    
     # Health check section
     with st.sidebar:
         st.markdown("---")
@@ -351,7 +500,17 @@ def main():
         
         if st.button("🔄 Vérifier l'état"):
             with st.spinner("Vérification..."):
-                health = asyncio.run(health_check_async())
+                try:
+                    agent = get_agent(
+                        mcp_url=st.session_state.agent_config["mcp_url"],
+                        llm_provider="vertex",  # Use vertex by default for health check
+                        project_id=st.session_state.agent_config["project_id"] or os.getenv("PROJECT_ID", "dummy"),
+                        openai_api_key=None
+                    )
+                except Exception as e:
+                    health = {"status": "unhealthy", "error": str(e)}
+                else:
+                    health = run_async(health_check_async(agent))
                 
                 if health["status"] == "healthy":
                     st.success("✅ Système opérationnel")
@@ -379,23 +538,15 @@ def main():
         
         with col_clear:
             if st.button("🗑️ Effacer l'historique", use_container_width=True):
-                st.session_state.conversation_history = []
+                st.session_state.conversation_history = ConversationHistory()
                 st.success("Historique effacé!")
                 st.rerun()
     
     with col2:
         # Example questions
         st.markdown("### 💡 Questions d'exemple")
-        example_questions = [
-            "Comment packager un modèle pour Cloud Run ?",
-            "Configuration Docker pour Python",
-            "API endpoints disponibles",
-            "Installation des dépendances",
-            "Déploiement avec CI/CD"
-        ]
-        
-        for eq in example_questions:
-            if st.button(f"💬 {eq[:30]}...", key=f"example_{hash(eq)}", use_container_width=True):
+        for eq, label, key in zip(EXAMPLE_QUESTIONS, EXAMPLE_LABELS, EXAMPLE_KEYS):
+            if st.button(label, key=key, use_container_width=True):
                 question = eq
                 ask_button = True
     
@@ -403,7 +554,26 @@ def main():
     if ask_button and question.strip():
         with st.spinner("🤔 Traitement de votre question..."):
             # Process question
-            result = asyncio.run(process_question_async(question, filters))
+            # Example questions are searched by their precomputed embedding
+            query_embedding = get_example_embeddings(
+                st.session_state.agent_config["mcp_url"]
+            ).get(question)
+            
+            # Resolve the cached agent from session state in the script
+            # thread; only the awaiting runs on the shared loop, which the
+            # agent's HTTP pool is bound to
+            agent_config = st.session_state.agent_config
+            try:
+                agent = get_agent(
+                    mcp_url=agent_config["mcp_url"],
+                    llm_provider=agent_config["llm_provider"],
+                    project_id=agent_config["project_id"],
+                    openai_api_key=agent_config["openai_api_key"]
+                )
+            except Exception as e:
+                result = {"success": False, "response": None, "error": str(e)}
+            else:
+                result = run_async(process_question_async(agent, question, filters, query_embedding))
             
             if result["success"]:
                 response = result["response"]
@@ -413,14 +583,14 @@ def main():
                 display_response(response, filters)
                 
                 # Add to conversation history
-                st.session_state.conversation_history.append({
-                    "question": question,
-                    "answer": response.answer,
-                    "sources": response.sources,
-                    "response_time": response.response_time,
-                    "timestamp": datetime.now().strftime("%H:%M:%S"),
-                    "trace_id": response.trace_id
-                })
+                st.session_state.conversation_history.append(
+                    question=question,
+                    answer=response.answer,
+                    sources=response.sources,
+                    response_time=response.response_time,
+                    timestamp=datetime.now().strftime("%H:%M:%S"),
+                    trace_id=response.trace_id
+                )
                 
             else:
                 st.error(f"❌ Erreur: {result['error']}")